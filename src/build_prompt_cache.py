@@ -0,0 +1,38 @@
+import argparse
+import torch
+from objectclear.pipelines import ObjectClearPipeline
+
+
+if __name__ == '__main__':
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    parser = argparse.ArgumentParser(description='Precompute the prompt embeddings used by the worker so it can run without text encoders.')
+
+    parser.add_argument('-o', '--output_path', type=str, default='./prompt_cache.pt',
+                        help='Where to write the cache. Default: ./prompt_cache.pt')
+    parser.add_argument('-p', '--prompt', type=str, action='append', default=None,
+                        help='Prompt to cache, can be repeated. Default: "remove the instance of object"')
+    parser.add_argument('--negative_prompt', type=str, default=None,
+                        help='Negative prompt to cache the prompts with. Default: None')
+    parser.add_argument('--cache_dir', type=str, default=None,
+                        help="Path to cache directory")
+    parser.add_argument('--use_fp16', action='store_true',
+                        help='Use float16 for inference')
+    args = parser.parse_args()
+
+    prompts = args.prompt or ["remove the instance of object"]
+
+    torch_dtype = torch.float16 if args.use_fp16 else torch.float32
+    variant = "fp16" if args.use_fp16 else None
+    pipe = ObjectClearPipeline.from_pretrained_with_custom_modules(
+        "jixin0101/ObjectClear",
+        torch_dtype=torch_dtype,
+        cache_dir=args.cache_dir,
+        variant=variant,
+    )
+    pipe.to(device)
+
+    for prompt in prompts:
+        pipe.cache_prompt_embeds(prompt, negative_prompt=args.negative_prompt)
+    pipe.prompt_cache.save(args.output_path)
+
+    print(f'Cached {len(prompts)} prompt(s) in {args.output_path}')
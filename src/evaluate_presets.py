@@ -0,0 +1,115 @@
+import os
+import argparse
+import glob
+import json
+import time
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+from objectclear.pipelines import ObjectClearPipeline, SCHEDULER_PRESETS
+from objectclear.utils import resize_by_short_side
+
+
+def psnr(a, b, region=None):
+    diff = (a.astype(np.float64) - b.astype(np.float64)) ** 2
+    mse = diff[region].mean() if region is not None else diff.mean()
+    return float('inf') if mse == 0 else float(10 * np.log10(255.0 ** 2 / mse))
+
+def ssim(a, b):
+    # gaussian-window SSIM on the luma channel, as in Wang et al. 2004
+    a = cv2.cvtColor(a, cv2.COLOR_RGB2GRAY).astype(np.float64)
+    b = cv2.cvtColor(b, cv2.COLOR_RGB2GRAY).astype(np.float64)
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    blur = lambda x: cv2.GaussianBlur(x, (11, 11), 1.5)
+    mu_a, mu_b = blur(a), blur(b)
+    var_a = blur(a * a) - mu_a ** 2
+    var_b = blur(b * b) - mu_b ** 2
+    cov = blur(a * b) - mu_a * mu_b
+    ssim_map = ((2 * mu_a * mu_b + c1) * (2 * cov + c2)) / ((mu_a ** 2 + mu_b ** 2 + c1) * (var_a + var_b + c2))
+    return float(ssim_map.mean())
+
+def run_preset(pipe, name, samples, seed, device):
+    call_kwargs = pipe.apply_scheduler_preset(name)
+    outputs, seconds = [], []
+    for image, mask in samples:
+        w, h = image.size
+        start = time.perf_counter()
+        result = pipe(
+            prompt="remove the instance of object",
+            image=image,
+            mask_image=mask,
+            generator=torch.Generator(device=device).manual_seed(seed),
+            height=h,
+            width=w,
+            **call_kwargs,
+        )
+        seconds.append(time.perf_counter() - start)
+        outputs.append(np.array(result.images[0]))
+    return outputs, seconds
+
+
+if __name__ == '__main__':
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    parser = argparse.ArgumentParser(description='Measure the quality delta of every scheduler preset against the 20-step "quality" baseline.')
+
+    parser.add_argument('-i', '--input_path', type=str, default='./inputs/imgs',
+                        help='Input image folder. Default: inputs/imgs')
+    parser.add_argument('-m', '--mask_path', type=str, default='./inputs/masks',
+                        help='Input mask folder. Default: inputs/masks')
+    parser.add_argument('-o', '--output_path', type=str, default='results/preset_quality.json',
+                        help='Where to write the report. Default: results/preset_quality.json')
+    parser.add_argument('--cache_dir', type=str, default=None,
+                        help="Path to cache directory")
+    parser.add_argument('--use_fp16', action='store_true',
+                        help='Use float16 for inference')
+    parser.add_argument('--seed', type=int, default=42,
+                        help='Random seed for torch.Generator. Default: 42')
+    args = parser.parse_args()
+
+    input_img_list = sorted(glob.glob(os.path.join(args.input_path, '*.[jpJP][pnPN]*[gG]')))
+    input_mask_list = sorted(glob.glob(os.path.join(args.mask_path, '*.[jpJP][pnPN]*[gG]')))
+    if len(input_img_list) != len(input_mask_list):
+        raise ValueError(f"Mismatch between input images ({len(input_img_list)}) and masks ({len(input_mask_list)}).")
+
+    samples = []
+    for img_path, mask_path in zip(input_img_list, input_mask_list):
+        image = resize_by_short_side(Image.open(img_path).convert("RGB"), 512, resample=Image.BICUBIC)
+        mask = resize_by_short_side(Image.open(mask_path).convert("L"), 512, resample=Image.NEAREST)
+        samples.append((image, mask))
+
+    torch_dtype = torch.float16 if args.use_fp16 else torch.float32
+    variant = "fp16" if args.use_fp16 else None
+    pipe = ObjectClearPipeline.from_pretrained_with_custom_modules(
+        "jixin0101/ObjectClear",
+        torch_dtype=torch_dtype,
+        cache_dir=args.cache_dir,
+        variant=variant,
+    )
+    pipe.to(device)
+
+    baseline, baseline_seconds = run_preset(pipe, "quality", samples, args.seed, device)
+    report = {
+        "baseline": {"preset": "quality", "seconds_per_image": float(np.mean(baseline_seconds))},
+        "presets": {},
+    }
+    for name in SCHEDULER_PRESETS:
+        if name == "quality":
+            continue
+        outputs, seconds = run_preset(pipe, name, samples, args.seed, device)
+        masks = [np.array(mask) > 127 for _, mask in samples]
+        report["presets"][name] = {
+            **SCHEDULER_PRESETS[name].call_kwargs(),
+            "scheduler": SCHEDULER_PRESETS[name].scheduler,
+            "seconds_per_image": float(np.mean(seconds)),
+            "speedup": float(np.mean(baseline_seconds) / np.mean(seconds)),
+            "psnr": float(np.mean([psnr(o, b) for o, b in zip(outputs, baseline)])),
+            "psnr_mask": float(np.mean([psnr(o, b, m) for o, b, m in zip(outputs, baseline, masks)])),
+            "ssim": float(np.mean([ssim(o, b) for o, b in zip(outputs, baseline)])),
+        }
+        print(f'{name}: ' + ', '.join(f'{k}={v:.3f}' for k, v in report["presets"][name].items() if isinstance(v, float)))
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output_path)), exist_ok=True)
+    with open(args.output_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Report written to {args.output_path}')
@@ -2,8 +2,9 @@ import os
 import argparse
 import glob
 import torch
-from objectclear.pipelines import ObjectClearPipeline
-from objectclear.utils import resize_by_short_side
+from objectclear.pipelines import ObjectClearPipeline, SCHEDULER_PRESETS
+from objectclear.utils import resize_by_short_side, select_precision
+from objectclear.utils.precision import PRECISIONS
 from PIL import Image
 import numpy as np
 
@@ -21,17 +22,39 @@ if __name__ == '__main__':
                         help='Output folder. Default: results/<input_name>')
     parser.add_argument('--cache_dir', type=str, default=None,
                         help="Path to cache directory")
+    parser.add_argument('--precision', type=str, default='auto', choices=PRECISIONS,
+                        help='auto: fp16 on GPU, bf16 autocast (or fp32) on CPU. Default: auto')
     parser.add_argument('--use_fp16', action='store_true', 
-                        help='Use float16 for inference')
+                        help='Same as --precision fp16')
     parser.add_argument('--seed', type=int, default=42, 
-                    help='Random seed for torch.Generator. Default: 42')
+                    help='Base seed; every image gets a generator seeded from it and its content. Default: 42')
     parser.add_argument('--steps', type=int, default=20, 
                         help='Number of diffusion inference steps. Default: 20')
     parser.add_argument('--guidance_scale', type=float, default=2.5, 
                         help='CFG guidance scale. Default: 2.5')
+    parser.add_argument('--guidance_steps', type=int, default=None,
+                        help='Only apply CFG for the first N steps. Default: all steps')
+    parser.add_argument('--preset', type=str, default=None, choices=sorted(SCHEDULER_PRESETS),
+                        help='Scheduler preset; overrides --steps, --guidance_scale and --guidance_steps')
     parser.add_argument('--no_agf', action='store_true', 
                         help='Disable Attention Guided Fusion')
+    parser.add_argument('--batch_size', type=int, default=1,
+                        help='Number of same-size images denoised together. Default: 1')
+    parser.add_argument('--deep_cache_interval', type=int, default=0,
+                        help='Run the full UNet every N steps and reuse its deep features in between. Default: 0 (disabled)')
+    parser.add_argument('--compile', action='store_true',
+                        help='Compile the UNet and VAE decoder with torch.compile')
+    parser.add_argument('--compile_cache_dir', type=str, default=None,
+                        help='Persistent torch.compile cache directory. Default: inductor default')
+    parser.add_argument('--quantize', type=str, default=None, choices=['int8', 'int8-conv'],
+                        help='int8 quantization of the UNet and encoders on CPU; loads the pipeline in float32')
+    parser.add_argument('--tile_size', type=int, default=0,
+                        help='Denoise images longer than this many pixels in tiles, only the tiles that touch the mask; also tiles the VAE. Default: 0 (disabled)')
+    parser.add_argument('--tile_overlap', type=int, default=256,
+                        help='Overlap in pixels between neighbouring tiles with --tile_size. Default: 256')
     args = parser.parse_args()
+    if args.quantize is not None and device.type != 'cpu':
+        parser.error('--quantize is only supported on CPU')
     
     
     # ------------------------ input & output ------------------------
@@ -61,26 +84,38 @@ if __name__ == '__main__':
     
     
     # ------------------ set up ObjectClear pipeline -------------------
-    torch_dtype = torch.float16 if args.use_fp16 else torch.float32
-    variant = "fp16" if args.use_fp16 else None
-    generator = torch.Generator(device=device).manual_seed(args.seed)
+    precision = 'fp16' if args.use_fp16 else args.precision
+    if args.quantize is not None:
+        # dynamic int8 kernels take float32 activations
+        precision = 'fp32'
+    policy = select_precision(device, precision)
+    print(f'Precision policy: {policy}')
     use_agf = not args.no_agf
     pipe = ObjectClearPipeline.from_pretrained_with_custom_modules(
         "jixin0101/ObjectClear",
-        torch_dtype=torch_dtype,
+        precision=policy,
         apply_attention_guided_fusion=use_agf,
         cache_dir=args.cache_dir,
-        variant=variant,
+        use_compile=args.compile,
+        compile_cache_dir=args.compile_cache_dir,
+        quantize=args.quantize,
     )
     pipe.to(device)
+    if args.deep_cache_interval > 0:
+        pipe.enable_deep_cache(args.deep_cache_interval)
+    if args.tile_size > 0:
+        pipe.enable_tiled_diffusion(args.tile_size, args.tile_overlap)
+    if args.preset is not None:
+        preset_kwargs = pipe.apply_scheduler_preset(args.preset)
+        args.steps = preset_kwargs["num_inference_steps"]
+        args.guidance_scale = preset_kwargs["guidance_scale"]
+        args.guidance_steps = preset_kwargs["guidance_steps"]
     
     
     # -------------------- start to processing ---------------------
-    for i, (img_path, mask_path) in enumerate(zip(input_img_list, input_mask_list)):
-        img_name = os.path.basename(img_path)
-        basename, ext = os.path.splitext(img_name)
-        print(f'[{i+1}/{test_img_num}] Processing: {img_name}')
-        
+    # group inputs that share the same size after resizing, so they can be denoised in one batch
+    buckets = {}
+    for img_path, mask_path in zip(input_img_list, input_mask_list):
         image = Image.open(img_path).convert("RGB")
         mask = Image.open(mask_path).convert("L")
         image_or = image.copy()
@@ -89,26 +124,36 @@ if __name__ == '__main__':
         # Resizing the input so that the **shorter side is 512** helps achieve the best performance.
         image = resize_by_short_side(image, 512, resample=Image.BICUBIC)
         mask = resize_by_short_side(mask, 512, resample=Image.NEAREST)
-        
-        w, h = image.size
+
+        buckets.setdefault(image.size, []).append((img_path, image, mask, image_or.size))
+
+    i = 0
+    for (w, h), items in buckets.items():
+        for start in range(0, len(items), args.batch_size):
+            batch = items[start:start + args.batch_size]
+            for img_path, _, _, _ in batch:
+                i += 1
+                print(f'[{i}/{test_img_num}] Processing: {os.path.basename(img_path)}')
     
-        result = pipe(
-            prompt="remove the instance of object",
-            image=image,
-            mask_image=mask,
-            generator=generator,
-            num_inference_steps=args.steps,
-            guidance_scale=args.guidance_scale,
-            height=h,
-            width=w,
-            return_attn_map=False,
-        )
-        
-        fused_img_pil = result.images[0]
+            result = pipe(
+                prompt="remove the instance of object",
+                image=[image for _, image, _, _ in batch],
+                mask_image=[mask for _, _, mask, _ in batch],
+                seed=args.seed,
+                num_inference_steps=args.steps,
+                guidance_scale=args.guidance_scale,
+                guidance_steps=args.guidance_steps,
+                height=h,
+                width=w,
+                return_attn_map=False,
+            )
+
+            for (img_path, _, _, original_size), fused_img_pil in zip(batch, result.images):
+                basename, ext = os.path.splitext(os.path.basename(img_path))
 
-        # save results
-        save_path = os.path.join(result_root, f'{basename}.png')
-        fused_img_pil = fused_img_pil.resize(image_or.size)
-        fused_img_pil.save(save_path)
+                # save results
+                save_path = os.path.join(result_root, f'{basename}.png')
+                fused_img_pil = fused_img_pil.resize(original_size)
+                fused_img_pil.save(save_path)
 
     print(f'\nAll results are saved in {result_root}')
\ No newline at end of file
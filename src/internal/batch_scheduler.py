@@ -0,0 +1,56 @@
+import time
+from typing import Any, Callable, Hashable, Optional
+
+
+class ShapeBucketBatcher:
+    def __init__(self, max_batch_size: int = 4, max_wait: float = 5.0, clock: Callable[[], float] = time.monotonic) -> None:
+        """
+        Group jobs by shape bucket so each bucket can be sent to the pipeline as one batch.
+
+        A bucket is released as soon as it holds `max_batch_size` jobs, or once its
+        oldest job has been waiting for `max_wait` seconds.
+        """
+        if max_batch_size < 1:
+            raise ValueError(f"max_batch_size has to be at least 1 but is {max_batch_size}")
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._clock = clock
+        self._buckets: dict[Hashable, list[tuple[float, Any]]] = {}
+
+    def add(self, key: Hashable, job: Any) -> None:
+        """
+        Queue `job` in the bucket `key`.
+        """
+        self._buckets.setdefault(key, []).append((self._clock(), job))
+
+    def pop_ready(self, force: bool = False) -> list[tuple[Hashable, list[Any]]]:
+        """
+        Take every batch that is ready to run, or all queued jobs when `force` is set.
+        """
+        now = self._clock()
+        ready = []
+        for key in list(self._buckets):
+            entries = self._buckets[key]
+            while entries and (
+                len(entries) >= self.max_batch_size or force or now - entries[0][0] >= self.max_wait
+            ):
+                ready.append((key, [job for _, job in entries[:self.max_batch_size]]))
+                entries = entries[self.max_batch_size:]
+
+            if entries:
+                self._buckets[key] = entries
+            else:
+                del self._buckets[key]
+        return ready
+
+    def time_to_deadline(self) -> Optional[float]:
+        """
+        Seconds until the oldest queued job has to be released, or None when nothing is queued.
+        """
+        if not self._buckets:
+            return None
+        oldest = min(entries[0][0] for entries in self._buckets.values())
+        return max(0.0, self.max_wait - (self._clock() - oldest))
+
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self._buckets.values())
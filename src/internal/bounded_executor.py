@@ -0,0 +1,28 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable
+
+
+class BoundedExecutor:
+    def __init__(self, max_workers: int, max_pending: int, thread_name_prefix: str = "") -> None:
+        """
+        Thread pool whose `submit` blocks while `max_pending` tasks are queued or running, so a
+        fast producer is slowed down to the pace of the pool instead of piling up work.
+        """
+        if max_pending < max_workers:
+            raise ValueError(f"max_pending has to be at least max_workers ({max_workers}) but is {max_pending}")
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def submit(self, fn: Callable[..., Any], *args, **kwargs) -> Future:
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
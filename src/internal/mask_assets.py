@@ -0,0 +1,136 @@
+import io
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from PIL import Image
+from services.boto import S3
+from services.logger import log
+
+
+@dataclass
+class MaskTemplate:
+    image: Image.Image
+    etag: str
+    checked_at: float
+
+
+@dataclass(frozen=True)
+class BuiltMask:
+    """
+    A mask built from a template and its PNG encoding. Shared between jobs, never modify `image`.
+    """
+    image: Image.Image
+    png: bytes
+
+
+class MaskAssetCache:
+    def __init__(self, cache_dir: Optional[str] = None, revalidate_interval: float = 300.0, max_masks: int = 32) -> None:
+        """
+        Mask templates decoded to RGBA and kept in memory, revalidated against S3 by ETag at
+        most every `revalidate_interval` seconds, which costs no transfer while they are unchanged.
+
+        With `cache_dir`, templates are also kept on disk: a restarted worker revalidates its
+        disk copy instead of downloading it, and keeps working from it while S3 is unreachable.
+
+        Masks built from a template are memoized for the last `max_masks` (template, orientation,
+        image size) combinations, since photos cluster on a few sizes.
+        """
+        self.cache_dir = cache_dir
+        self.revalidate_interval = revalidate_interval
+        self.max_masks = max_masks
+        self._lock = threading.Lock()
+        self._templates: dict[tuple[str, str], MaskTemplate] = {}
+        self._masks: OrderedDict[tuple, BuiltMask] = OrderedDict()
+
+    def template(self, s3: S3, path: str) -> MaskTemplate:
+        key = (s3.bucket, path)
+        with self._lock:
+            template = self._templates.get(key)
+        if template is not None and time.monotonic() - template.checked_at < self.revalidate_interval:
+            return template
+
+        if template is None:
+            template = self._read_disk(s3.bucket, path)
+        try:
+            fetched = s3.get_object_if_changed(path, template.etag if template is not None else None)
+        except Exception as e:
+            if template is None:
+                raise
+            log.warning(f"Could not revalidate mask template {path}, using the cached copy: {e}")
+            fetched = None
+        if fetched is not None:
+            data, etag = fetched
+            template = MaskTemplate(_decode(data), etag, 0.0)
+            self._write_disk(s3.bucket, path, data, etag)
+            log.info(f"Loaded mask template {path} ({etag})")
+        template.checked_at = time.monotonic()
+
+        with self._lock:
+            self._templates[key] = template
+        return template
+
+    def mask(self, s3: S3, path: str, orientation: str, size: tuple[int, int], build: Callable[[Image.Image, tuple[int, int]], Image.Image]) -> BuiltMask:
+        """
+        The mask of `size` that `build` makes from the template at `path`, memoized.
+        """
+        template = self.template(s3, path)
+        key = (s3.bucket, path, template.etag, orientation, size)
+        with self._lock:
+            built = self._masks.get(key)
+            if built is not None:
+                self._masks.move_to_end(key)
+                return built
+
+        image = build(template.image, size)
+        png = io.BytesIO()
+        image.save(png, format="PNG")
+        built = BuiltMask(image, png.getvalue())
+        with self._lock:
+            self._masks[key] = built
+            while len(self._masks) > self.max_masks:
+                self._masks.popitem(last=False)
+        return built
+
+    def _disk_path(self, bucket: str, path: str) -> str:
+        return os.path.join(self.cache_dir, bucket, path)  # type: ignore
+
+    def _read_disk(self, bucket: str, path: str) -> Optional[MaskTemplate]:
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(self._disk_path(bucket, path), "rb") as f:
+                data = f.read()
+            with open(self._disk_path(bucket, path) + ".etag") as f:
+                etag = f.read().strip()
+            return MaskTemplate(_decode(data), etag, 0.0)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            log.warning(f"Ignoring unreadable cached mask template {path}: {e}")
+            return None
+
+    def _write_disk(self, bucket: str, path: str, data: bytes, etag: str) -> None:
+        if self.cache_dir is None:
+            return
+        dest = self._disk_path(bucket, path)
+        try:
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            for suffix, content in (("", data), (".etag", etag.encode())):
+                # write to a temporary file first so that a crash never leaves a truncated template behind
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dest), suffix=".tmp")
+                with os.fdopen(fd, "wb") as f:
+                    f.write(content)
+                os.replace(tmp_path, dest + suffix)
+        except OSError as e:
+            log.warning(f"Could not store mask template {path} on disk: {e}")
+
+
+def _decode(data: bytes) -> Image.Image:
+    image = Image.open(io.BytesIO(data)).convert("RGBA")
+    image.load()
+    return image
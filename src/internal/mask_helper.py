@@ -1,53 +1,77 @@
-import os
 from PIL import Image
 import io
 from services.boto import S3 as ServiceS3
 from services.logger import log
 from services.cmdb import CMDB
+from internal.mask_assets import MaskAssetCache
 from abc import ABC, abstractmethod
 
 
 class Mask(ABC):
     buff_mask: io.BufferedReader | None = None  # This should be of type io.BytesIO
-    buff_original: io.BufferedReader | None = None  # This should be of type io.BytesIO
 
     @abstractmethod
     def apply_mask(self):
+        """
+        Build `mask` (and `buff_mask`) for the original. Storing them is left to `store_artifacts`.
+        """
         raise NotImplementedError("Subclasses should implement this method")
 
-    def __init__(self, s3_record, phone) -> None:
-        self.s3_workspace = ServiceS3("minas-workspace-prod")
-        self.cmdb_client = CMDB(os.getenv("MINAS_CMDB_URL"))
+    @property
+    def template_key(self) -> str:
+        """
+        Identifies the mask template, so that results are only reused between jobs masked the same way.
+        """
+        return type(self).__name__
+
+    def __init__(self, s3_record, phone, original_image: Image.Image, s3_workspace: ServiceS3, cmdb_client: CMDB) -> None:
+        """
+        `original_image` is the decoded original that `s3_record` (the ORIGINAL step) refers to,
+        so it is not downloaded again; the record may still be in the making.
+        """
+        self.s3_workspace = s3_workspace
+        self.cmdb_client = cmdb_client
 
-        self.original_path = s3_record["s3_uri"].replace("s3://minas-workspace-prod/", "")
         self.__s3_record = s3_record
         self.phone = phone
+        self.original_image = original_image
 
-        self.__open_original_image()
-
-    def store_mask(self):
+    def upload_mask(self) -> dict:
+        """
+        Upload the mask and return its s3 record, without creating it in the CMDB.
+        """
         file_name = self.__s3_record["s3_uri"].split("/")[-1].split(".")[0]  # type: ignore
-        print(self.__s3_record)
         phone = self.phone.replace("+", "")  # type: ignore
         self.s3_workspace.upload_object(f"{phone}/{file_name}_mask.png", self.buff_mask)
-
+        return {
+            "content_id": self.__s3_record["content_id"],
+            "step": "MASK",
+            "s3_uri": self.s3_workspace.uri(f"{phone}/{file_name}_mask.png"),
+            "s3_url": "",
+        }
+
+    def store_artifacts(self):
+        """
+        Upload the mask and the opacity preview, then create both s3 records in one concurrent call.
+        """
+        records = [self.upload_mask(), self.upload_opacity()]
         try:
-            self.cmdb_client.create_s3_content({
-                "content_id": self.__s3_record["content_id"],
-                "step": "MASK",
-                "s3_uri": f"s3://minas-workspace-prod/{phone}/{file_name}_mask.png",
-                "s3_url": "",
-            })
+            for record, response in zip(records, self.cmdb_client.create_s3_contents(records)):
+                if not response.ok:
+                    log.error(f"Failed to create S3 record for {record['step'].lower()}: {response.status_code}")
         except Exception as e:
-            log.error(f"Failed to create S3 record for mask: {e}")
-
-    def store_opacity(self):
-        if not self.buff_original or not self.buff_mask:
-            raise Exception("buff_original or buff_mask are not set")
-
-        res_image = Image.open(self.buff_original)
-        ref_image = Image.open(self.buff_mask)
-        ref_image = ref_image.convert("RGBA")
+            log.error(f"Failed to create S3 records for mask and opacity: {e}")
+
+    def upload_opacity(self) -> dict:
+        """
+        Upload the mask laid over the original at 50% opacity and return its s3 record, without
+        creating it in the CMDB.
+        """
+        if not self.buff_mask:
+            raise Exception("buff_mask is not set")
+
+        res_image = self.original_image.copy()
+        ref_image = self.mask.convert("RGBA")
         ref_image_with_opacity = ref_image.copy()
         ref_image_with_opacity.putalpha(128)  # [0 to 255] e.g.: 128 is 50% oppacity
         res_image.paste(
@@ -64,32 +88,24 @@ class Mask(ABC):
         self.s3_workspace.upload_object(
             f"{phone}/{file_name}_opacity.png", output.getvalue()
         )
-        try:
-            self.cmdb_client.create_s3_content({
-                "content_id": self.__s3_record["content_id"],
-                "step": "OPACITY",
-                "s3_uri": f"s3://minas-workspace-prod/{phone}/{file_name}_opacity.png",
-                "s3_url": "",
-            })
-        except Exception as e:
-            log.error(f"Failed to create S3 record for opacity: {e}")
-
-    def __open_original_image(self):
-        # TODO: should I resize here?
-        # if original_image.width > 800:
-        #     original_image.thumbnail((800, 800))
-        byte_image = self.s3_workspace.get_object(self.original_path)
-        raw: io.RawIOBase = io.BytesIO(byte_image)  # type: ignore
-        self.buff_original = io.BufferedReader(raw)
-        self.original_image = Image.open(raw)  # type: ignore
-        return self.original_image
+        return {
+            "content_id": self.__s3_record["content_id"],
+            "step": "OPACITY",
+            "s3_uri": self.s3_workspace.uri(f"{phone}/{file_name}_opacity.png"),
+            "s3_url": "",
+        }
 
 
 class PrivateMask(Mask):
-    def __init__(self, s3_record, phone) -> None:
-        super().__init__(s3_record, phone)
+    def __init__(self, s3_record, phone, original_image: Image.Image, s3_workspace: ServiceS3, cmdb_client: CMDB, mask_assets: MaskAssetCache) -> None:
+        super().__init__(s3_record, phone, original_image, s3_workspace, cmdb_client)
+        self.mask_assets = mask_assets
         self.__init_orientation()
 
+    @property
+    def template_key(self) -> str:
+        return f"private:{self.orientation}"
+
     def __init_orientation(self):
         if self.original_image.width > self.original_image.height:
             self.orientation = "LANDSCAPE"
@@ -98,50 +114,36 @@ class PrivateMask(Mask):
 
     def apply_mask(self):
         if self.orientation == "LANDSCAPE":
-            private_mask_h_cropped = self.s3_workspace.get_object(
-                "assets/private_h_mask.png"
-            )
-            raw: io.RawIOBase = io.BytesIO(private_mask_h_cropped)  # type: ignore
-            partial_mask = Image.open(raw)  # type: ignore
-
-            self.mask = Image.new(
-                "RGB", (self.original_image.width, self.original_image.height)
-            )
-            partial_mask = partial_mask.convert("RGBA")
-
-            self.mask.paste(
-                partial_mask, (0, 0 + self.mask.height - partial_mask.height), partial_mask
+            built = self.mask_assets.mask(
+                self.s3_workspace, "assets/private_h_mask.png", self.orientation, self.original_image.size, self.__build_landscape
             )
         else:
-            private_mask_v_cropped = self.s3_workspace.get_object(
-                "assets/private_v_mask.png"
+            built = self.mask_assets.mask(
+                self.s3_workspace, "assets/private_v_mask.png", self.orientation, self.original_image.size, self.__build_portrait
             )
-            raw: io.RawIOBase = io.BytesIO(private_mask_v_cropped)  # type: ignore
-            partial_mask = Image.open(raw)  # type: ignore
+        self.mask = built.image
+        self.buff_mask = io.BufferedReader(io.BytesIO(built.png))  # type: ignore
 
-            self.mask = Image.new(
-                "RGB", (self.original_image.width, self.original_image.height)
-            )
-            partial_mask = partial_mask.convert("RGBA")
-
-            self.mask.paste(
-                partial_mask, ((self.mask.width - partial_mask.width) // 2, 0 + self.mask.height - partial_mask.height), partial_mask
-            )
-
-        buffer = io.BytesIO()
-        self.mask.save(buffer, format="PNG")
-        buffer.seek(0)
-        self.buff_mask = io.BufferedReader(buffer)  # type: ignore
+    @staticmethod
+    def __build_landscape(partial_mask: Image.Image, size: tuple[int, int]) -> Image.Image:
+        mask = Image.new("RGB", size)
+        mask.paste(partial_mask, (0, 0 + mask.height - partial_mask.height), partial_mask)
+        return mask
 
-        self.store_mask()
-        self.store_opacity()
+    @staticmethod
+    def __build_portrait(partial_mask: Image.Image, size: tuple[int, int]) -> Image.Image:
+        mask = Image.new("RGB", size)
+        mask.paste(
+            partial_mask, ((mask.width - partial_mask.width) // 2, 0 + mask.height - partial_mask.height), partial_mask
+        )
+        return mask
 
 # Factory Class for Mask
 class MaskFactory:
     @staticmethod
-    def create_mask(domain, s3_record, phone) -> Mask:
+    def create_mask(domain, s3_record, phone, original_image: Image.Image, s3_workspace: ServiceS3, cmdb_client: CMDB, mask_assets: MaskAssetCache) -> Mask:
         if domain and "private" in domain:
             log.info("Minas detected")
-            return PrivateMask(s3_record, phone)
+            return PrivateMask(s3_record, phone, original_image, s3_workspace, cmdb_client, mask_assets)
         else:
             raise Exception("Domain not supported")
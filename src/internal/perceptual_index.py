@@ -0,0 +1,175 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+import cv2
+import numpy as np
+from PIL import Image, ImageFilter
+from services.logger import log
+
+
+def dhash(image: Image.Image, hash_size: int = 8) -> int:
+    """
+    Difference hash: sign of the horizontal gradient of a (hash_size + 1) x hash_size grayscale thumbnail.
+    """
+    pixels = np.asarray(image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR), dtype=np.int16)
+    return _to_int(pixels[:, 1:] > pixels[:, :-1])
+
+def phash(image: Image.Image, hash_size: int = 8, highfreq_factor: int = 4) -> int:
+    """
+    Perceptual hash: low-frequency DCT coefficients of a grayscale thumbnail compared with their median.
+    """
+    size = hash_size * highfreq_factor
+    pixels = np.asarray(image.convert("L").resize((size, size), Image.BILINEAR), dtype=np.float32)
+    low = cv2.dct(pixels)[:hash_size, :hash_size]
+    # the DC term only carries the mean brightness
+    return _to_int(low > np.median(low.flatten()[1:]))
+
+def _to_int(bits: np.ndarray) -> int:
+    return int.from_bytes(np.packbits(bits.flatten()).tobytes(), "big")
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+@dataclass(frozen=True)
+class ImageHashes:
+    phash: int
+    dhash: int
+
+    @classmethod
+    def of(cls, image: Image.Image) -> "ImageHashes":
+        return cls(phash=phash(image), dhash=dhash(image))
+
+
+@dataclass
+class RemovalPatch:
+    """
+    Inpainted region of a finished job: the output inside the mask bounding box, with the
+    mask as alpha, and where that box sat in the image.
+    """
+    patch: Image.Image
+    box: tuple[int, int, int, int]
+    image_size: tuple[int, int]
+
+    @classmethod
+    def from_result(cls, result: Image.Image, mask: Image.Image, margin: int = 8) -> Optional["RemovalPatch"]:
+        mask = mask.convert("L").resize(result.size, Image.NEAREST)
+        bbox = mask.getbbox()
+        if bbox is None:
+            return None
+        left, top, right, bottom = bbox
+        box = (max(0, left - margin), max(0, top - margin), min(result.width, right + margin), min(result.height, bottom + margin))
+        # feathered alpha, so the composite has no hard seam along the mask border
+        alpha = mask.filter(ImageFilter.MaxFilter(2 * (margin // 2) + 1)).filter(ImageFilter.GaussianBlur(margin / 2))
+        patch = result.convert("RGB").crop(box)
+        patch.putalpha(alpha.crop(box))
+        return cls(patch=patch, box=box, image_size=result.size)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Memory taken by the decoded patch pixels.
+        """
+        return self.patch.width * self.patch.height * len(self.patch.getbands())
+
+    def composite(self, image: Image.Image) -> Image.Image:
+        """
+        Paste the patch onto `image`, a near-duplicate of the job it came from, rescaled to
+        the size of `image`.
+        """
+        sx = image.width / self.image_size[0]
+        sy = image.height / self.image_size[1]
+        left, top, right, bottom = self.box
+        box = (round(left * sx), round(top * sy), round(right * sx), round(bottom * sy))
+        patch = self.patch.resize((max(1, box[2] - box[0]), max(1, box[3] - box[1])), Image.BICUBIC)
+        output = image.convert("RGB")
+        output.paste(patch, box[:2], patch)
+        return output
+
+
+class PerceptualIndex:
+    def __init__(self, max_bytes: int, phash_threshold: int = 6, dhash_threshold: int = 8, log_every: int = 100) -> None:
+        """
+        Removal patches of the most recent jobs, looked up by perceptual hash, evicted least
+        recently used first once their decoded pixels take more than `max_bytes`.
+
+        A job is a near-duplicate of an indexed one when both the pHash and the dHash are
+        within their Hamming distance thresholds (out of 64 bits) and the mask template
+        matches. Re-encoded or rescaled copies of a photo land well below the defaults.
+        Entries are kept per mask template, so a lookup only scans jobs masked the same way.
+        The metrics are logged every `log_every` lookups.
+        """
+        self.max_bytes = max_bytes
+        self.phash_threshold = phash_threshold
+        self.dhash_threshold = dhash_threshold
+        self.log_every = log_every
+        self._lock = threading.Lock()
+        # recency over all templates, for eviction
+        self._entries: OrderedDict[int, tuple[ImageHashes, str, RemovalPatch]] = OrderedDict()
+        self._by_template: dict[str, dict[int, ImageHashes]] = {}
+        self._next_id = 0
+        self._size = 0
+        self._lookups = 0
+        self._hits = 0
+
+    def add(self, hashes: ImageHashes, template_key: str, patch: RemovalPatch) -> None:
+        if patch.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (hashes, template_key, patch)
+            self._by_template.setdefault(template_key, {})[entry_id] = hashes
+            self._size += patch.nbytes
+            while self._size > self.max_bytes:
+                old_id, (_, old_template, old_patch) = self._entries.popitem(last=False)
+                del self._by_template[old_template][old_id]
+                if not self._by_template[old_template]:
+                    del self._by_template[old_template]
+                self._size -= old_patch.nbytes
+
+    def find(self, hashes: ImageHashes, template_key: str) -> Optional[RemovalPatch]:
+        """
+        The patch of the closest indexed near-duplicate with the same mask template, if any.
+        """
+        with self._lock:
+            self._lookups += 1
+            best, best_distance = None, None
+            for entry_id, entry_hashes in self._by_template.get(template_key, {}).items():
+                p_distance = hamming(hashes.phash, entry_hashes.phash)
+                d_distance = hamming(hashes.dhash, entry_hashes.dhash)
+                if p_distance > self.phash_threshold or d_distance > self.dhash_threshold:
+                    continue
+                if best_distance is None or p_distance + d_distance < best_distance:
+                    best, best_distance = entry_id, p_distance + d_distance
+            patch = None
+            if best is not None:
+                self._hits += 1
+                self._entries.move_to_end(best)
+                patch = self._entries[best][2]
+            if self.log_every and self._lookups % self.log_every == 0:
+                log.info(f"Near-duplicate index: {self._metrics()}")
+            return patch
+
+    @property
+    def hit_rate(self) -> float:
+        with self._lock:
+            return self._hit_rate()
+
+    def _hit_rate(self) -> float:
+        return self._hits / self._lookups if self._lookups else 0.0
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return self._metrics()
+
+    def _metrics(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._size,
+            "lookups": self._lookups,
+            "hits": self._hits,
+            "hit_rate": round(self._hit_rate(), 4),
+        }
@@ -0,0 +1,135 @@
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from botocore.exceptions import ClientError
+from objectclear.utils import content_digest
+from services.boto import S3
+from services.logger import log
+
+
+def result_key(original: bytes, mask: bytes, **params) -> str:
+    """
+    Content address of a job: the digest of the original image bytes, the mask bytes and every
+    parameter that changes the output (steps, guidance, seed, model revision, ...).
+    """
+    return content_digest(original, mask, json.dumps(params, sort_keys=True, default=str))
+
+
+class DiskResultCache:
+    def __init__(self, root: str, max_bytes: int) -> None:
+        """
+        Results stored as files under `root`, evicted least recently used first once they
+        take more than `max_bytes`. Recency is the file mtime, so it survives restarts.
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._size = 0
+
+        os.makedirs(root, exist_ok=True)
+        files = []
+        for dir_path, _, names in os.walk(root):
+            for name in names:
+                if name.endswith(".png"):
+                    stat = os.stat(os.path.join(dir_path, name))
+                    files.append((stat.st_mtime, name[:-len(".png")], stat.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._size += size
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}.png")
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            if key not in self._entries:
+                return None
+            try:
+                with open(self._path(key), "rb") as f:
+                    data = f.read()
+                os.utime(self._path(key))
+            except FileNotFoundError:
+                self._size -= self._entries.pop(key)
+                return None
+            self._entries.move_to_end(key)
+            return data
+
+    def put(self, key: str, data: bytes) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file first so that a crash never leaves a truncated result behind
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._size += len(data) - self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                old_key, old_size = self._entries.popitem(last=False)
+                self._size -= old_size
+                try:
+                    os.remove(self._path(old_key))
+                except FileNotFoundError:
+                    pass
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class S3ResultCache:
+    def __init__(self, s3_client: S3, prefix: str = "object-clear-cache") -> None:
+        """
+        Results shared between workers under `prefix` in an S3 bucket. Expiry is left to the
+        bucket's lifecycle rules.
+        """
+        self.s3_client = s3_client
+        self.prefix = prefix.rstrip("/")
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            return self.s3_client.get_object(f"{self.prefix}/{key}.png")
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+                return None
+            raise
+
+    def put(self, key: str, data: bytes) -> None:
+        self.s3_client.upload_object(f"{self.prefix}/{key}.png", data)
+
+
+class ResultCache:
+    def __init__(self, disk: DiskResultCache, s3: Optional[S3ResultCache] = None) -> None:
+        """
+        Two-tier result cache: the local disk first, then S3. S3 hits are copied to disk.
+        Errors of the S3 tier are logged and treated as misses, so they never fail a job.
+        """
+        self.disk = disk
+        self.s3 = s3
+
+    def get(self, key: str) -> Optional[bytes]:
+        data = self.disk.get(key)
+        if data is not None or self.s3 is None:
+            return data
+        try:
+            data = self.s3.get(key)
+        except Exception as e:
+            log.warning(f"Result cache S3 lookup failed: {e}")
+            return None
+        if data is not None:
+            self.disk.put(key, data)
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        self.disk.put(key, data)
+        if self.s3 is not None:
+            try:
+                self.s3.put(key, data)
+            except Exception as e:
+                log.warning(f"Result cache S3 upload failed: {e}")
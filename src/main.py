@@ -2,136 +2,453 @@
 # import glob
 import argparse
 import io
-import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Any, Optional
 
 import boto3
 import torch
-from objectclear.pipelines import ObjectClearPipeline
-from objectclear.utils import resize_by_short_side
+from objectclear.pipelines import ObjectClearPipeline, SCHEDULER_PRESETS
+from objectclear.utils import content_digest, content_generator, mask_crop_size, resize_by_short_side, select_precision, short_side_size
+from objectclear.utils.precision import PRECISIONS
 from PIL import Image
 import numpy as np
-from requests import Response
 from services.cmdb import CMDB
 from services.boto import S3, JobStatusDynamo
+from services.registry import ClientRegistry, load_projects
+from services.sqs import SQSConsumer
 from services.logger import log
+from internal.batch_scheduler import ShapeBucketBatcher
+from internal.bounded_executor import BoundedExecutor
 from internal.image_helper import ImageHelper
-from internal.mask_helper import MaskFactory
+from internal.mask_assets import MaskAssetCache
+from internal.mask_helper import Mask, MaskFactory
+from internal.perceptual_index import ImageHashes, PerceptualIndex, RemovalPatch
+from internal.result_cache import DiskResultCache, ResultCache, S3ResultCache, result_key
 from utils import Utils
 from utils.schemas import JobEnvelope
 import json
 
+PROMPT = "remove the instance of object"
+MODEL_ID = "jixin0101/ObjectClear"
 
-def object_clear(image: Image.Image, mask: Image.Image) -> io.BytesIO:
-    image = image.convert("RGB")
-    mask = mask.convert("L")
-    image_or = image.copy()
+# Aspect ratios whose `short_side_size` buckets are compiled before the worker starts pulling jobs.
+WARMUP_ASPECT_RATIOS = [(1, 1), (4, 3), (3, 4), (3, 2), (2, 3), (16, 9), (9, 16)]
 
-    # Our model was trained on 512×512 resolution.
-    # Resizing the input so that the **shorter side is 512** helps achieve the best performance.
-    image = resize_by_short_side(image, 512, resample=Image.BICUBIC)
-    mask = resize_by_short_side(mask, 512, resample=Image.NEAREST)
-    
-    w, h = image.size
+
+def diffusion_size(image: Image.Image, mask: Image.Image) -> tuple[int, int]:
+    """
+    Size an image/mask pair is denoised at: the whole image at 512 short side, or with
+    --crop_to_mask only the window around the mask.
+    """
+    if args.crop_to_mask:
+        return mask_crop_size(mask, args.crop_margin, 512)
+    return short_side_size(*image.size, 512)
+
+def warm_up(sizes: list[tuple[int, int]]) -> None:
+    """
+    Run a blank image through the pipeline for every (width, height) in `sizes`, alone and
+    as a full batch, so that compilation happens before the first real job.
+    """
+    batch_sizes = sorted({1, args.max_batch_size})
+    for w, h in sizes:
+        image = Image.new("RGB", (w, h), (127, 127, 127))
+        mask = Image.new("L", (w, h), 0)
+        mask.paste(255, (w // 4, h // 4, 3 * w // 4, 3 * h // 4))
+        for batch_size in batch_sizes:
+            start = time.monotonic()
+            object_clear_batch([image] * batch_size, [mask] * batch_size)
+            log.info(f"Warm-up {w}x{h} x{batch_size} took {time.monotonic() - start:.1f}s")
+
+def object_clear_batch(images: list[Image.Image], masks: list[Image.Image], digests: Optional[list[str]] = None) -> list[io.BytesIO]:
+    """
+    Run object removal on several image/mask pairs in a single pipeline call.
+    All pairs must share the same `diffusion_size`.
+
+    Every pair gets its own generator, seeded from --seed and its content `digest` (by default
+    the digest of the image and mask pixels), so a job gets the same result on any replica and
+    in any batch.
+    """
+    if digests is None:
+        digests = [content_digest(image, mask) for image, mask in zip(images, masks)]
+    generators = [content_generator(args.seed, digest, device=device) for digest in digests]
+    original_sizes = [image.size for image in images]
+    images = [image.convert("RGB") for image in images]
+    masks = [mask.convert("L") for mask in masks]
+
+    sizes = {diffusion_size(image, mask) for image, mask in zip(images, masks)}
+    if len(sizes) != 1:
+        raise ValueError(f"Images of a batch must share the same diffusion size, got {sorted(sizes)}")
+    w, h = sizes.pop()
+
+    if args.crop_to_mask:
+        # Only the window around the mask is denoised; the pipeline pastes it back into the full-size image.
+        crop_kwargs = {"padding_mask_crop": args.crop_margin}
+    else:
+        # Our model was trained on 512×512 resolution.
+        # Resizing the input so that the **shorter side is 512** helps achieve the best performance.
+        images = [resize_by_short_side(image, 512, resample=Image.BICUBIC) for image in images]
+        masks = [resize_by_short_side(mask, 512, resample=Image.NEAREST) for mask in masks]
+        crop_kwargs = {}
 
     result = pipe(
-        prompt="remove the instance of object",
-        image=image,
-        mask_image=mask,
-        generator=generator,
+        prompt=PROMPT,
+        image=images,
+        mask_image=masks,
+        generator=generators,
         num_inference_steps=args.steps,
         guidance_scale=args.guidance_scale,
+        guidance_steps=args.guidance_steps,
         height=h,
         width=w,
         return_attn_map=False,
+        **crop_kwargs,
     )
 
-    fused_img_pil = result.images[0]
+    outputs = []
+    for fused_img_pil, original_size in zip(result.images, original_sizes):
+        # save results
+        fused_img_pil = fused_img_pil.resize(original_size)
 
-    # save results
-    fused_img_pil = fused_img_pil.resize(image_or.size)
+        output = io.BytesIO()
+        fused_img_pil.save(output, format="PNG")
+        outputs.append(output)
 
-    output = io.BytesIO()
-    fused_img_pil.save(output, format="PNG")
+    return outputs
+
+@dataclass
+class ObjectClearJob:
+    task_definition: JobEnvelope
+    message: Any
+    s3_client: S3
+    cmdb: CMDB
+    content: dict
+    phone: str
+    file_name: str
+    original_image: Image.Image
+    mask_image: Image.Image
+    digest: Optional[str] = None
+    cache_key: Optional[str] = None
+    template_key: Optional[str] = None
+    hashes: Optional[ImageHashes] = None
+    inputs_upload: Optional[Future] = None
+
+    @property
+    def bucket(self) -> tuple[int, int]:
+        """
+        Size the job is denoised at; jobs in the same bucket can share a batch.
+        """
+        return diffusion_size(self.original_image, self.mask_image)
+
+def result_params() -> dict:
+    """
+    Everything besides the image and mask that changes the output of a job, for the result cache key:
+    the model and its precision, the sampling settings and every approximation the pipeline is run
+    with (DeepCache, int8 weights, tiling, compiled kernels). The VAE latent cache is exact and left out.
+    """
+    return {
+        "model": f"{MODEL_ID}@{args.model_revision or 'main'}",
+        "precision": policy.precision,
+        "preset": args.preset,
+        "steps": args.steps,
+        "guidance_scale": args.guidance_scale,
+        "guidance_steps": args.guidance_steps,
+        "seed": args.seed,
+        "agf": not args.no_agf,
+        "crop_margin": args.crop_margin if args.crop_to_mask else None,
+        "tile_size": args.tile_size or None,
+        "tile_overlap": args.tile_overlap if args.tile_size else None,
+        "deep_cache_interval": args.deep_cache_interval or None,
+        "quantize": args.quantize,
+        "compile": args.compile,
+    }
+
+def prepare_job(task_definition: JobEnvelope, message: Any = None) -> ObjectClearJob:
+    """
+    Download the content, store the original and build its mask: everything that runs before inference.
+    """
+    project = clients.project(task_definition.payload.meta.project_id)
+    s3_client, cmdb = project.s3, project.cmdb
+
+    content = cmdb.get_content_by_id(task_definition.payload.meta.content_id).json()
+
+    phone: str = content['profile']['contact']['phone'].replace("+", "")
+    domain: str = content['profile']['site']['domain'].split(".")[0]
+    identifier: str = Utils.generate_identifier()
+
+    image_helper: ImageHelper = ImageHelper.from_url(content['url'])
+    image_helper.resize()
+    file_name = f"{domain}-{phone}-{identifier}.jpg"
+    dest_path = f"{phone}/{file_name}"
+    s3_record = {
+        "content_id": content['id'],
+        "step": "ORIGINAL",
+        "s3_uri": s3_client.uri(dest_path),
+        "s3_url": "",
+    }
+
+    # APPLY MASK
+    mask = MaskFactory.create_mask(domain, s3_record, phone, image_helper.image, s3_client, cmdb, mask_assets)
+    mask.apply_mask()
+    # the original, mask and opacity preview are encoded, uploaded and recorded off the critical path
+    inputs_upload = store_pool.submit(store_inputs, image_helper, dest_path, s3_record, s3_client, cmdb, mask)
+
+    mask_bytes = io.BytesIO()
+    mask.mask.save(mask_bytes, format="PNG")
+    original_digest = content_digest(mask.original_image)
+    digest = content_digest(original_digest, mask_bytes.getvalue())
+    cache_key = None
+    if result_cache is not None:
+        cache_key = result_key(original_digest.encode(), mask_bytes.getvalue(), **result_params())
+    hashes = ImageHashes.of(mask.original_image) if near_duplicates is not None else None
 
+    return ObjectClearJob(
+        task_definition=task_definition,
+        message=message,
+        s3_client=s3_client,
+        cmdb=cmdb,
+        content=content,
+        phone=phone,
+        file_name=file_name,
+        original_image=mask.original_image,
+        mask_image=mask.mask,
+        digest=digest,
+        cache_key=cache_key,
+        template_key=mask.template_key,
+        hashes=hashes,
+        inputs_upload=inputs_upload,
+    )
+
+def store_inputs(image_helper: ImageHelper, dest_path: str, s3_record: dict, s3_client: S3, cmdb: CMDB, mask: Mask):
+    """
+    Store and record the original, then the mask and opacity preview, so that they are never
+    recorded before the original or without it.
+    """
+    s3_client.upload_object(dest_path, image_helper.get_bytes())
+    cmdb.create_s3_content(s3_record).raise_for_status()
+    mask.store_artifacts()
+
+def cached_result(job: ObjectClearJob) -> Optional[io.BytesIO]:
+    """
+    The stored output of an identical earlier job, if the result cache has one.
+    """
+    if job.cache_key is None:
+        return None
+    data = result_cache.get(job.cache_key)
+    if data is None:
+        return None
+    log.info(f"Result cache hit for content {job.content['id']}")
+    return io.BytesIO(data)
+
+def near_duplicate_result(job: ObjectClearJob) -> Optional[io.BytesIO]:
+    """
+    Composite the removal patch of an earlier near-duplicate photo with the same mask template onto the original.
+    """
+    if job.hashes is None:
+        return None
+    patch = near_duplicates.find(job.hashes, job.template_key)
+    if patch is None:
+        return None
+    log.info(f"Near-duplicate hit for content {job.content['id']}")
+    output = io.BytesIO()
+    patch.composite(job.original_image).save(output, format="PNG")
     return output
 
-def process_image(task_definition: JobEnvelope):
+def reused_result(job: ObjectClearJob) -> Optional[io.BytesIO]:
+    """
+    The output of an identical or near-identical earlier job, without running the model.
+    """
+    result = cached_result(job)
+    if result is None:
+        result = near_duplicate_result(job)
+    return result
+
+def store_result(job: ObjectClearJob, result: io.BytesIO):
+    if job.cache_key is not None:
+        try:
+            result_cache.put(job.cache_key, result.getvalue())
+        except Exception as e:
+            log.exception(e)
+    if job.hashes is not None:
+        try:
+            patch = RemovalPatch.from_result(Image.open(io.BytesIO(result.getvalue())), job.mask_image)
+            if patch is not None:
+                near_duplicates.add(job.hashes, job.template_key, patch)
+        except Exception as e:
+            log.exception(e)
+
+def finish_job(job: ObjectClearJob, result: io.BytesIO):
+    """
+    Store the inpainted image and record it in the CMDB, after the original and its mask.
+    """
+    if job.inputs_upload is not None:
+        # raises if the original could not be stored, so no result is recorded without it
+        job.inputs_upload.result()
+    job.s3_client.upload_object(f"{job.phone}/{job.file_name}_watermark_removed.png", result.getvalue())
+
+    job.cmdb.create_s3_content({
+        "content_id": job.content['id'],
+        "step": "WATERMARK_REMOVED",
+        "s3_uri": job.s3_client.uri(f"{job.phone}/{job.file_name}_watermark_removed.png"),
+        "s3_url": "",
+    })
+
+def run_batch(jobs: list[ObjectClearJob]) -> Optional[list[io.BytesIO]]:
+    """
+    Remove objects for a bucket of same-size jobs in one pipeline call. None if the batch failed.
+    """
     try:
-        if task_definition.payload.meta.project_id == "MINAS":
-            s3_client = S3("minas-workspace-prod")
-            url = os.getenv("MINAS_CMDB_URL")
-            assert url is not None, "MINAS_CMDB_URL environment variable not set"
-            cmdb = CMDB(url)
-        elif task_definition.payload.meta.project_id == "ROSA":
-            s3_client = S3("rosa-workspace-prod")
-            url = os.getenv("ROSA_CMDB_URL")
-            assert url is not None, "ROSA_CMDB_URL environment variable not set"
-            cmdb = CMDB(url)
-        else:
-            raise ValueError(f"Unknown project_id: {task_definition.payload.meta.project_id}")
-
-        content = cmdb.get_content_by_id(task_definition.payload.meta.content_id).json()
-
-        phone: str = content['profile']['contact']['phone'].replace("+", "")
-        domain: str = content['profile']['site']['domain'].split(".")[0]
-        identifier: str = Utils.generate_identifier()
-
-        image_helper: ImageHelper = ImageHelper.from_url(content['url'])
-        image_helper.resize()
-        file_name = f"{domain}-{phone}-{identifier}.jpg"
-        dest_path = f"{phone}/{file_name}"
-        s3_client.upload_object(dest_path, image_helper.get_bytes())
-        s3_record_response: Response = cmdb.create_s3_content({
-            "content_id": content['id'],
-            "step": "ORIGINAL",
-            "s3_uri": f"s3://minas-workspace-prod/{dest_path}",
-            "s3_url": "",
-        })
-        s3_record_response.raise_for_status()
-        s3_record = s3_record_response.json()
-
-        # APPLY MASK
-        mask = MaskFactory.create_mask(domain, s3_record, phone)
-        mask.apply_mask()
-
-        # REMOVE OBJECT
-        original_image = mask.original_image
-        masked_image = mask.mask
-
-        result = object_clear(original_image, masked_image)
-        s3_client.upload_object(f"{phone}/{file_name}_watermark_removed.png", result.getvalue())
-
-        cmdb.create_s3_content({
-            "content_id": content['id'],
-            "step": "WATERMARK_REMOVED",
-            "s3_uri": f"s3://minas-workspace-prod/{phone}/{file_name}_watermark_removed.png",
-            "s3_url": "",
-        })
+        log.info(f"Worker running batch of {len(jobs)} job(s) at {jobs[0].bucket}")
+        return object_clear_batch(
+            [job.original_image for job in jobs],
+            [job.mask_image for job in jobs],
+            [job.digest for job in jobs],
+        )
     except Exception as e:
         log.exception(e)
+        return None
 
-def main():
-    sqs = boto3.resource("sqs", region_name="eu-west-1")
-    dynamo = JobStatusDynamo()
-    queue = sqs.get_queue_by_name(QueueName="vc-job-queue")
-
-    while True:
-        messages = queue.receive_messages(MaxNumberOfMessages=10, WaitTimeSeconds=20)
-        for message in messages:
+def finish_batch(jobs: list[ObjectClearJob], results: Optional[list[io.BytesIO]], dynamo: JobStatusDynamo):
+    """
+    Store and record the results of a batch, then acknowledge its jobs.
+    """
+    for i, job in enumerate(jobs):
+        if results is not None:
+            store_result(job, results[i])
             try:
-                data = json.loads(message.body)
-                task_definition = JobEnvelope.model_validate(data)
-                log.info(f"Worker processing message: {task_definition}")
-                if task_definition.payload.job == 'OBJECT_REMOVAL':
-                    dynamo.put_item(hash="OBJECT_CLEAR", range=task_definition.request_id, meta={'status': 'PENDING'})
-                    process_image(task_definition)
-                    dynamo.put_item(hash="OBJECT_CLEAR", range=task_definition.request_id, meta={'status': 'COMPLETED'})
+                finish_job(job, results[i])
             except Exception as e:
-                log.info(f"Worker exception while processing message")
                 log.exception(e)
-                continue
+        complete_message(job.task_definition, job.message, dynamo)
+
+def complete_message(task_definition: JobEnvelope, message: Any, dynamo: JobStatusDynamo):
+    """
+    Mark the job completed and acknowledge its message. The message is acknowledged even if the
+    status cannot be written, so it never keeps its in-flight slot.
+    """
+    try:
+        dynamo.put_item(hash="OBJECT_CLEAR", range=task_definition.request_id, meta={'status': 'COMPLETED'})
+    except Exception as e:
+        log.info(f"Worker exception while completing message")
+        log.exception(e)
+    finally:
+        message.delete()
 
+def accept_message(message: Any, dynamo: JobStatusDynamo) -> Optional[JobEnvelope]:
+    """
+    Parse a queue message and mark it pending. None if it is not an object removal job, or if it
+    cannot be accepted; such messages are released for redelivery, so a body that never parses
+    ends up in the dead-letter queue.
+    """
+    try:
+        data = json.loads(message.body)
+        task_definition = JobEnvelope.model_validate(data)
+        log.info(f"Worker processing message: {task_definition}")
+        if task_definition.payload.job != 'OBJECT_REMOVAL':
             message.delete()
+            return None
+
+        dynamo.put_item(hash="OBJECT_CLEAR", range=task_definition.request_id, meta={'status': 'PENDING'})
+        return task_definition
+    except Exception as e:
+        log.info(f"Worker exception while processing message")
+        log.exception(e)
+        message.release()
+        return None
+
+def prepare_stage(task_definition: JobEnvelope, message: Any, dynamo: JobStatusDynamo, prepared: queue.Queue):
+    """
+    I/O stage before inference. Jobs whose result can be reused are finished right here, the
+    others are handed to the inference stage through the bounded `prepared` queue.
+    """
+    try:
+        job = prepare_job(task_definition, message)
+    except Exception as e:
+        log.exception(e)
+        complete_message(task_definition, message, dynamo)
+        return
+
+    try:
+        result = reused_result(job)
+    except Exception as e:
+        # a failed lookup only costs the shortcut, the model still produces the result
+        log.exception(e)
+        result = None
+
+    if result is None:
+        prepared.put(job)
+        return
+
+    # reposted photo or redelivered message: skip the model entirely
+    try:
+        finish_job(job, result)
+    except Exception as e:
+        log.exception(e)
+    complete_message(task_definition, message, dynamo)
+
+def receive_loop(consumer: SQSConsumer, dynamo: JobStatusDynamo, prepare_pool: BoundedExecutor, prepared: queue.Queue):
+    """
+    Pull messages and hand them to the prepare pool. Blocks while the pool is full, and the
+    consumer only receives as many messages as it has capacity for, so no more messages are
+    received than the worker can keep up with.
+    """
+    while True:
+        try:
+            messages = consumer.receive()
+        except Exception as e:
+            log.exception(e)
+            time.sleep(1)
+            continue
+        for message in messages:
+            task_definition = accept_message(message, dynamo)
+            if task_definition is not None:
+                prepare_pool.submit(prepare_stage, task_definition, message, dynamo, prepared)
+
+def main():
+    """
+    Staged worker: a receiver thread feeds a pool that downloads, stores and masks the jobs,
+    the main thread runs inference on the prepared jobs, and a second pool uploads and records
+    the results. The stages are connected by bounded queues, so downloads for the next batch
+    and uploads of the last one overlap with inference.
+
+    At most one batch plus the prefetched jobs are in flight; their visibility is extended
+    until they are acknowledged, and acknowledgements are deleted in batches.
+    """
+    sqs = boto3.client("sqs", region_name="eu-west-1")
+    dynamo = clients.dynamo
+    queue_url = sqs.get_queue_url(QueueName="vc-job-queue")["QueueUrl"]
+    consumer = SQSConsumer(
+        sqs,
+        queue_url,
+        capacity=args.max_batch_size + args.prefetch_jobs,
+        visibility_timeout=args.visibility_timeout,
+    ).start()
+    batcher = ShapeBucketBatcher(max_batch_size=args.max_batch_size, max_wait=args.max_batch_wait)
+
+    prepared: queue.Queue[ObjectClearJob] = queue.Queue(maxsize=args.prefetch_jobs)
+    prepare_pool = BoundedExecutor(args.io_workers, 2 * args.io_workers, thread_name_prefix="prepare")
+    finish_pool = BoundedExecutor(args.io_workers, 2 * args.io_workers, thread_name_prefix="finish")
+    threading.Thread(
+        target=receive_loop, args=(consumer, dynamo, prepare_pool, prepared), name="receive", daemon=True
+    ).start()
+
+    while True:
+        # wait for the next prepared job, but not past the moment the oldest batched job has to run
+        try:
+            job = prepared.get(timeout=batcher.time_to_deadline())
+            batcher.add(job.bucket, job)
+            while True:
+                job = prepared.get_nowait()
+                batcher.add(job.bucket, job)
+        except queue.Empty:
+            pass
+
+        for _, jobs in batcher.pop_ready():
+            results = run_batch(jobs)
+            finish_pool.submit(finish_batch, jobs, results, dynamo)
 
 if __name__ == '__main__':
     device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
@@ -141,25 +458,102 @@ if __name__ == '__main__':
     parser.add_argument('-m', '--mask_path', type=str, default='./inputs/masks', help='Input mask image or folder. Default: inputs/masks')
     parser.add_argument('-o', '--output_path', type=str, default=None, help='Output folder. Default: results/<input_name>')
     parser.add_argument('--cache_dir', type=str, default=None, help="Path to cache directory")
-    parser.add_argument('--use_fp16', default=True, action='store_true', help='Use float16 for inference')
-    parser.add_argument('--seed', type=int, default=42, help='Random seed for torch.Generator. Default: 42')
+    parser.add_argument('--precision', type=str, default='auto', choices=PRECISIONS, help='auto: fp16 on GPU, bf16 autocast (or fp32) on CPU. Default: auto')
+    parser.add_argument('--use_fp16', action='store_true', help='Same as --precision fp16')
+    parser.add_argument('--seed', type=int, default=42, help='Base seed; every image gets a generator seeded from it and its content. Default: 42')
     parser.add_argument('--steps', type=int, default=20, help='Number of diffusion inference steps. Default: 20')
     parser.add_argument('--guidance_scale', type=float, default=2.5, help='CFG guidance scale. Default: 2.5')
+    parser.add_argument('--guidance_steps', type=int, default=None, help='Only apply CFG for the first N steps. Default: all steps')
+    parser.add_argument('--preset', type=str, default=None, choices=sorted(SCHEDULER_PRESETS), help='Scheduler preset; overrides --steps, --guidance_scale and --guidance_steps')
     parser.add_argument('--no_agf', action='store_true', help='Disable Attention Guided Fusion')
+    parser.add_argument('--prompt_cache', type=str, default=None, help='Path to a prompt-embedding cache built with build_prompt_cache.py')
+    parser.add_argument('--no_text_encoders', action='store_true', help='Do not load the text encoders; requires --prompt_cache')
+    parser.add_argument('--crop_to_mask', action='store_true', help='Only denoise a window around the mask and paste it back into the image')
+    parser.add_argument('--crop_margin', type=int, default=32, help='Context in pixels kept around the mask bbox with --crop_to_mask. Default: 32')
+    parser.add_argument('--max_batch_size', type=int, default=4, help='Maximum number of same-size jobs denoised together. Default: 4')
+    parser.add_argument('--max_batch_wait', type=float, default=5.0, help='Seconds a job may wait for its batch to fill up. Default: 5.0')
+    parser.add_argument('--io_workers', type=int, default=4, help='Threads downloading/masking jobs ahead of inference, and as many uploading results. Default: 4')
+    parser.add_argument('--prefetch_jobs', type=int, default=8, help='Prepared jobs kept ready for the inference stage. Default: 8')
+    parser.add_argument('--projects_config', type=str, default=None, help='JSON file mapping project ids to their bucket and CMDB URL variable. Default: MINAS and ROSA')
+    parser.add_argument('--mask_asset_dir', type=str, default=None, help='Directory keeping a copy of the mask templates, used when S3 is unreachable. Default: memory only')
+    parser.add_argument('--mask_asset_ttl', type=float, default=300.0, help='Seconds before a mask template is revalidated against S3 by ETag. Default: 300')
+    parser.add_argument('--mask_memo_size', type=int, default=32, help='Number of built masks memoized by template, orientation and image size. Default: 32')
+    parser.add_argument('--visibility_timeout', type=int, default=300, help='SQS visibility timeout in seconds, extended by a heartbeat while a job is in flight. Default: 300')
+    parser.add_argument('--latent_cache_size', type=int, default=0, help='Number of VAE-encoded images to keep across jobs. Default: 0 (disabled)')
+    parser.add_argument('--deep_cache_interval', type=int, default=0, help='Run the full UNet every N steps and reuse its deep features in between. Default: 0 (disabled)')
+    parser.add_argument('--compile', action='store_true', help='Compile the UNet and VAE decoder and warm them up before pulling jobs')
+    parser.add_argument('--compile_cache_dir', type=str, default=None, help='Persistent torch.compile cache directory. Default: inductor default')
+    parser.add_argument('--warmup_sizes', type=str, nargs='*', default=None, help='WxH sizes to warm up with --compile. Default: the 512 short-side buckets of common aspect ratios')
+    parser.add_argument('--quantize', type=str, default=None, choices=['int8', 'int8-conv'], help='int8 quantization of the UNet and encoders on CPU; loads the pipeline in float32')
+    parser.add_argument('--tile_size', type=int, default=0, help='Denoise images longer than this many pixels in tiles, only the tiles that touch the mask; also tiles the VAE. Default: 0 (disabled)')
+    parser.add_argument('--tile_overlap', type=int, default=256, help='Overlap in pixels between neighbouring tiles with --tile_size. Default: 256')
+    parser.add_argument('--model_revision', type=str, default=None, help='Revision (branch, tag or commit) of the model to load. Default: main')
+    parser.add_argument('--result_cache_dir', type=str, default=None, help='Local directory of the result cache for repeated image+mask jobs. Default: disabled')
+    parser.add_argument('--result_cache_size_mb', type=int, default=2048, help='Size of the local result cache before the least recently used results are evicted. Default: 2048')
+    parser.add_argument('--result_cache_bucket', type=str, default=None, help='S3 bucket shared by the workers as second result cache tier; requires --result_cache_dir')
+    parser.add_argument('--result_cache_prefix', type=str, default='object-clear-cache', help='Key prefix of the S3 result cache tier. Default: object-clear-cache')
+    parser.add_argument('--near_duplicate_index_mb', type=int, default=0, help='Memory for the removal patches of finished jobs, reused for perceptually identical photos. Default: 0 (disabled)')
+    parser.add_argument('--phash_threshold', type=int, default=6, help='Max pHash Hamming distance (of 64 bits) of a near-duplicate. Default: 6')
+    parser.add_argument('--dhash_threshold', type=int, default=8, help='Max dHash Hamming distance (of 64 bits) of a near-duplicate. Default: 8')
 
     args = parser.parse_args()
 
-    torch_dtype = torch.float16 if args.use_fp16 else torch.float32
-    variant = "fp16" if args.use_fp16 else None
-    generator = torch.Generator(device=device).manual_seed(args.seed)
+    precision = 'fp16' if args.use_fp16 else args.precision
+    if args.quantize is not None:
+        # dynamic int8 kernels take float32 activations
+        precision = 'fp32'
+    policy = select_precision(device, precision)
+    log.info(f"Precision policy: {policy}")
     use_agf = not args.no_agf
+    if args.no_text_encoders and args.prompt_cache is None:
+        parser.error('--no_text_encoders requires --prompt_cache')
+    if args.quantize is not None and device.type != 'cpu':
+        parser.error('--quantize is only supported on CPU')
+    if args.result_cache_bucket is not None and args.result_cache_dir is None:
+        parser.error('--result_cache_bucket requires --result_cache_dir')
+    # one set of clients for the whole process, shared by the prepare, store and finish pools
+    clients = ClientRegistry(load_projects(args.projects_config), pool_size=max(10, 3 * args.io_workers))
+    # background writes of the originals, off the critical path of the prepare stage
+    store_pool = BoundedExecutor(args.io_workers, 2 * args.io_workers, thread_name_prefix="store")
+    mask_assets = MaskAssetCache(args.mask_asset_dir, args.mask_asset_ttl, args.mask_memo_size)
+    result_cache = None
+    if args.result_cache_dir is not None:
+        s3_tier = None
+        if args.result_cache_bucket is not None:
+            s3_tier = S3ResultCache(clients.s3(args.result_cache_bucket), prefix=args.result_cache_prefix)
+        result_cache = ResultCache(DiskResultCache(args.result_cache_dir, args.result_cache_size_mb * 1024 * 1024), s3_tier)
+    near_duplicates = None
+    if args.near_duplicate_index_mb > 0:
+        near_duplicates = PerceptualIndex(args.near_duplicate_index_mb * 1024 * 1024, args.phash_threshold, args.dhash_threshold)
     pipe = ObjectClearPipeline.from_pretrained_with_custom_modules(
-        "jixin0101/ObjectClear",
-        torch_dtype=torch_dtype,
+        MODEL_ID,
+        revision=args.model_revision,
+        precision=policy,
         apply_attention_guided_fusion=use_agf,
         cache_dir=args.cache_dir,
-        variant=variant,
+        load_text_encoders=not args.no_text_encoders,
+        prompt_cache_path=args.prompt_cache,
+        use_compile=args.compile,
+        compile_cache_dir=args.compile_cache_dir,
+        quantize=args.quantize,
     )
     pipe.to(device)
+    if args.latent_cache_size > 0:
+        pipe.enable_vae_latent_cache(args.latent_cache_size)
+    if args.deep_cache_interval > 0:
+        pipe.enable_deep_cache(args.deep_cache_interval)
+    if args.tile_size > 0:
+        pipe.enable_tiled_diffusion(args.tile_size, args.tile_overlap)
+    if args.preset is not None:
+        preset_kwargs = pipe.apply_scheduler_preset(args.preset)
+        args.steps = preset_kwargs["num_inference_steps"]
+        args.guidance_scale = preset_kwargs["guidance_scale"]
+        args.guidance_steps = preset_kwargs["guidance_steps"]
+    if args.compile:
+        if args.warmup_sizes is None:
+            warmup_sizes = [short_side_size(1000 * w, 1000 * h, 512) for w, h in WARMUP_ASPECT_RATIOS]
+        else:
+            warmup_sizes = [tuple(int(v) for v in size.split('x')) for size in args.warmup_sizes]
+        warm_up(warmup_sizes)
 
     main()
@@ -1,5 +1,16 @@
+from .attention_processor import AttnMapCaptureProcessor
 from .clip_image_encoder import CLIPImageEncoder
+from .deep_cache import UNetFeatureCache
 from .postfuse_module import PostfuseModule
+from .quantization import Int8WeightOnlyConv2d, quantize_conv_weights_int8, quantize_linear_int8
 
 
-__all__ = ["CLIPImageEncoder", "PostfuseModule"]
\ No newline at end of file
+__all__ = [
+    "AttnMapCaptureProcessor",
+    "CLIPImageEncoder",
+    "Int8WeightOnlyConv2d",
+    "PostfuseModule",
+    "UNetFeatureCache",
+    "quantize_conv_weights_int8",
+    "quantize_linear_int8",
+]
\ No newline at end of file
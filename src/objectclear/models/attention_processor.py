@@ -0,0 +1,76 @@
+from typing import Optional
+
+import torch
+from diffusers.models.attention_processor import Attention, AttnProcessor2_0
+
+
+class AttnMapCaptureProcessor(AttnProcessor2_0):
+    r"""
+    Scaled dot-product attention processor that can additionally record how much every query attends to a single
+    text token (`token_index`), averaged over heads.
+
+    The attention output always goes through the fused SDPA kernel of [`AttnProcessor2_0`]. Only while `armed` is set,
+    the query/key projections are recomputed to get the softmax column of `token_index`, which is stored in
+    `attn_map` with shape `(batch, num_queries)`; the full `(batch * heads, num_queries, num_tokens)` probability
+    tensor is never kept around.
+    """
+
+    def __init__(self, token_index: int):
+        super().__init__()
+        self.token_index = token_index
+        self.armed = False
+        self.attn_map = None
+
+    def __call__(
+        self,
+        attn: Attention,
+        hidden_states: torch.Tensor,
+        encoder_hidden_states: Optional[torch.Tensor] = None,
+        attention_mask: Optional[torch.Tensor] = None,
+        temb: Optional[torch.Tensor] = None,
+        *args,
+        **kwargs,
+    ) -> torch.Tensor:
+        if self.armed:
+            self.attn_map = self.token_attention(attn, hidden_states, encoder_hidden_states, attention_mask)
+        return super().__call__(attn, hidden_states, encoder_hidden_states, attention_mask, temb, *args, **kwargs)
+
+    def token_attention(
+        self,
+        attn: Attention,
+        hidden_states: torch.Tensor,
+        encoder_hidden_states: Optional[torch.Tensor] = None,
+        attention_mask: Optional[torch.Tensor] = None,
+    ) -> torch.Tensor:
+        if hidden_states.ndim == 4:
+            batch_size, channel, height, width = hidden_states.shape
+            hidden_states = hidden_states.view(batch_size, channel, height * width).transpose(1, 2)
+        if attn.group_norm is not None:
+            hidden_states = attn.group_norm(hidden_states.transpose(1, 2)).transpose(1, 2)
+
+        if encoder_hidden_states is None:
+            encoder_hidden_states = hidden_states
+        elif attn.norm_cross:
+            encoder_hidden_states = attn.norm_encoder_hidden_states(encoder_hidden_states)
+
+        batch_size, sequence_length, _ = encoder_hidden_states.shape
+        query = attn.to_q(hidden_states)
+        key = attn.to_k(encoder_hidden_states)
+        head_dim = key.shape[-1] // attn.heads
+        query = query.view(batch_size, -1, attn.heads, head_dim).transpose(1, 2)
+        key = key.view(batch_size, -1, attn.heads, head_dim).transpose(1, 2)
+        if getattr(attn, "norm_q", None) is not None:
+            query = attn.norm_q(query)
+        if getattr(attn, "norm_k", None) is not None:
+            key = attn.norm_k(key)
+
+        # softmax statistics in float32, like `Attention.get_attention_scores` with `upcast_softmax`, also when the
+        # UNet runs under autocast
+        with torch.autocast(device_type=query.device.type, enabled=False):
+            scores = torch.matmul(query.float(), key.float().transpose(-1, -2)) * attn.scale
+            if attention_mask is not None:
+                attention_mask = attn.prepare_attention_mask(attention_mask, sequence_length, batch_size)
+                scores = scores + attention_mask.view(batch_size, attn.heads, -1, attention_mask.shape[-1]).float()
+
+            probs = torch.exp(scores[..., self.token_index] - torch.logsumexp(scores, dim=-1))
+        return probs.mean(dim=1)
@@ -10,12 +10,14 @@ class CLIPImageEncoder(CLIPPreTrainedModel):
     @staticmethod
     def from_pretrained(
         global_model_name_or_path,
-        cache_dir
+        cache_dir,
+        revision=None,
     ):
         model = CLIPModel.from_pretrained(
             global_model_name_or_path,
             subfolder="image_prompt_encoder", 
-            cache_dir=cache_dir
+            cache_dir=cache_dir,
+            revision=revision,
         )
         vision_model = model.vision_model
         visual_projection = model.visual_projection
@@ -0,0 +1,124 @@
+from typing import Any, Dict, Optional
+
+import torch
+from diffusers.models import UNet2DConditionModel
+
+
+class UNetFeatureCache:
+    r"""
+    DeepCache-style reuse of the deep UNet features across denoising steps.
+
+    A full UNet pass stores the output of the second to last up block. For the following steps only the shallow
+    path (`conv_in`, the first down block, the last up block and `conv_out`) is run, on top of the stored
+    features, until the next refresh. A step runs the full UNet when `step % cache_interval == 0`, when `full` is
+    requested, or when the stored features do not match the current batch.
+    """
+
+    def __init__(self, unet: UNet2DConditionModel, cache_interval: int = 3):
+        if cache_interval < 1:
+            raise ValueError(f"`cache_interval` has to be a positive integer but is {cache_interval}.")
+        self.unet = unet
+        self.cache_interval = cache_interval
+        self._features = None
+
+    def reset(self):
+        self._features = None
+
+    def __call__(
+        self,
+        step: int,
+        sample: torch.Tensor,
+        timestep: torch.Tensor,
+        encoder_hidden_states: torch.Tensor,
+        timestep_cond: Optional[torch.Tensor] = None,
+        cross_attention_kwargs: Optional[Dict[str, Any]] = None,
+        added_cond_kwargs: Optional[Dict[str, torch.Tensor]] = None,
+        full: bool = False,
+    ) -> torch.Tensor:
+        if (
+            full
+            or step % self.cache_interval == 0
+            or self._features is None
+            or self._features.shape[0] != sample.shape[0]
+        ):
+            return self._full_forward(
+                sample, timestep, encoder_hidden_states, timestep_cond, cross_attention_kwargs, added_cond_kwargs
+            )
+        return self._shallow_forward(
+            sample, timestep, encoder_hidden_states, timestep_cond, cross_attention_kwargs, added_cond_kwargs
+        )
+
+    def _full_forward(
+        self, sample, timestep, encoder_hidden_states, timestep_cond, cross_attention_kwargs, added_cond_kwargs
+    ):
+        def store_features(module, args, output):
+            self._features = output
+
+        handle = self.unet.up_blocks[-2].register_forward_hook(store_features)
+        try:
+            return self.unet(
+                sample,
+                timestep,
+                encoder_hidden_states=encoder_hidden_states,
+                timestep_cond=timestep_cond,
+                cross_attention_kwargs=cross_attention_kwargs,
+                added_cond_kwargs=added_cond_kwargs,
+                return_dict=False,
+            )[0]
+        finally:
+            handle.remove()
+
+    def _shallow_forward(
+        self, sample, timestep, encoder_hidden_states, timestep_cond, cross_attention_kwargs, added_cond_kwargs
+    ):
+        # same steps as UNet2DConditionModel.forward, limited to the outermost down/up block pair
+        unet = self.unet
+        if cross_attention_kwargs is not None:
+            cross_attention_kwargs = {k: v for k, v in cross_attention_kwargs.items() if k != "scale"}
+
+        t_emb = unet.get_time_embed(sample=sample, timestep=timestep)
+        emb = unet.time_embedding(t_emb, timestep_cond)
+        aug_emb = unet.get_aug_embed(
+            emb=emb, encoder_hidden_states=encoder_hidden_states, added_cond_kwargs=added_cond_kwargs
+        )
+        emb = emb + aug_emb if aug_emb is not None else emb
+        if unet.time_embed_act is not None:
+            emb = unet.time_embed_act(emb)
+
+        encoder_hidden_states = unet.process_encoder_hidden_states(
+            encoder_hidden_states=encoder_hidden_states, added_cond_kwargs=added_cond_kwargs
+        )
+
+        sample = unet.conv_in(sample)
+        down_block_res_samples = (sample,)
+        down_block = unet.down_blocks[0]
+        if getattr(down_block, "has_cross_attention", False):
+            sample, res_samples = down_block(
+                hidden_states=sample,
+                temb=emb,
+                encoder_hidden_states=encoder_hidden_states,
+                cross_attention_kwargs=cross_attention_kwargs,
+            )
+        else:
+            sample, res_samples = down_block(hidden_states=sample, temb=emb)
+        down_block_res_samples += res_samples
+
+        # the last up block takes the skip connections from `conv_in` and the first down block's resnets, the output
+        # of its downsampler belongs to the skipped blocks
+        up_block = unet.up_blocks[-1]
+        res_samples = down_block_res_samples[:len(up_block.resnets)]
+        if getattr(up_block, "has_cross_attention", False):
+            sample = up_block(
+                hidden_states=self._features,
+                temb=emb,
+                res_hidden_states_tuple=res_samples,
+                encoder_hidden_states=encoder_hidden_states,
+                cross_attention_kwargs=cross_attention_kwargs,
+            )
+        else:
+            sample = up_block(hidden_states=self._features, temb=emb, res_hidden_states_tuple=res_samples)
+
+        if unet.conv_norm_out:
+            sample = unet.conv_norm_out(sample)
+            sample = unet.conv_act(sample)
+        return unet.conv_out(sample)
@@ -0,0 +1,58 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torch.ao.quantization import quantize_dynamic
+
+
+class Int8WeightOnlyConv2d(nn.Module):
+    r"""
+    Conv2d whose weight is stored as int8 with one float scale per output channel and dequantized to the input dtype
+    on every call. Cuts the weight memory by 4x (fp32) while the convolution itself still runs in floating point.
+    """
+
+    def __init__(self, conv: nn.Conv2d):
+        super().__init__()
+        weight = conv.weight.detach().float()
+        scale = weight.abs().amax(dim=(1, 2, 3), keepdim=True).clamp(min=1e-8) / 127.0
+        self.register_buffer("weight_int8", torch.round(weight / scale).to(torch.int8))
+        self.register_buffer("weight_scale", scale.to(conv.weight.dtype))
+        self.bias = conv.bias
+        self.stride = conv.stride
+        self.padding = conv.padding
+        self.dilation = conv.dilation
+        self.groups = conv.groups
+        self.padding_mode = conv.padding_mode
+        self.in_channels = conv.in_channels
+        self.out_channels = conv.out_channels
+        self.kernel_size = conv.kernel_size
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        weight = self.weight_int8.to(x.dtype) * self.weight_scale.to(x.dtype)
+        bias = self.bias.to(x.dtype) if self.bias is not None else None
+        if self.padding_mode != "zeros":
+            x = F.pad(x, self._reversed_padding(), mode=self.padding_mode)
+            return F.conv2d(x, weight, bias, self.stride, 0, self.dilation, self.groups)
+        return F.conv2d(x, weight, bias, self.stride, self.padding, self.dilation, self.groups)
+
+    def _reversed_padding(self):
+        return [p for p in reversed(self.padding) for _ in range(2)]
+
+
+def quantize_linear_int8(module: nn.Module) -> nn.Module:
+    r"""
+    Replace every `nn.Linear` in `module` with its int8 dynamic-quantized counterpart (int8 weights, activations
+    quantized per call). Only runs on CPU and on float32 inputs.
+    """
+    return quantize_dynamic(module, {nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def quantize_conv_weights_int8(module: nn.Module) -> nn.Module:
+    r"""
+    Replace every `nn.Conv2d` in `module` with an [`Int8WeightOnlyConv2d`].
+    """
+    for name, child in list(module.named_children()):
+        if isinstance(child, nn.Conv2d):
+            setattr(module, name, Int8WeightOnlyConv2d(child))
+        else:
+            quantize_conv_weights_int8(child)
+    return module
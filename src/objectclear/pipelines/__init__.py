@@ -1,4 +1,5 @@
 from .pipeline_objectclear import ObjectClearPipeline
+from .scheduler_presets import SCHEDULER_PRESETS, SchedulerPreset
 
 
-__all__ = ["ObjectClearPipeline"]
\ No newline at end of file
+__all__ = ["ObjectClearPipeline", "SCHEDULER_PRESETS", "SchedulerPreset"]
\ No newline at end of file
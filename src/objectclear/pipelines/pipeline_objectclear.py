@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import contextlib
 import inspect
 from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 import os
@@ -42,7 +43,9 @@ from diffusers.models.attention_processor import (
     LoRAXFormersAttnProcessor,
     XFormersAttnProcessor,
 )
+from diffusers.models.autoencoders.vae import DiagonalGaussianDistribution
 from diffusers.models.lora import adjust_lora_scale_text_encoder
+from diffusers import schedulers
 from diffusers.schedulers import KarrasDiffusionSchedulers
 from diffusers.utils import (
     USE_PEFT_BACKEND,
@@ -59,9 +62,25 @@ from diffusers.pipelines.pipeline_utils import DiffusionPipeline, StableDiffusio
 from diffusers.pipelines.stable_diffusion_xl.pipeline_output import StableDiffusionXLPipelineOutput
 from dataclasses import dataclass
 
-from ..models import CLIPImageEncoder, PostfuseModule
-from ..utils import attention_guided_fusion
-import gc
+from ..models import (
+    AttnMapCaptureProcessor,
+    CLIPImageEncoder,
+    PostfuseModule,
+    UNetFeatureCache,
+    quantize_conv_weights_int8,
+    quantize_linear_int8,
+)
+from .scheduler_presets import SCHEDULER_PRESETS
+from .tiling import latent_tiles, tile_weights, tiles_touching_mask
+from ..utils import (
+    attention_guided_fusion_pt,
+    content_digest,
+    content_generator,
+    paste_crop,
+    LRUCache,
+    PromptEmbeddingCache,
+    tensor_digest,
+)
 import torch.nn.functional as F
 
 
@@ -78,6 +97,11 @@ else:
 
 logger = logging.get_logger(__name__)  # pylint: disable=invalid-name
 
+# Cross-attention layer whose attention to the fused object token drives attention guided fusion
+ATTN_MAP_LAYER = "down_blocks.1.attentions.0.transformer_blocks.0.attn2"
+# Position of the object token in the prompt embeddings, where `postfuse_module` injects the object embedding
+FUSE_INDEX = 5
+
 
 EXAMPLE_DOC_STRING = """
     Examples:
@@ -464,8 +488,184 @@ class ObjectClearPipeline(
             self.watermark = None
         
         if self.config.apply_attention_guided_fusion:
-            self.cross_attention_scores = {}
-            self.original_state = None
+            self.get_attn_map_processor()
+        self._keep_vae_upcast()
+
+        # VAE posteriors of the images seen during the current call, so that `image` and `masked_image` are only
+        # encoded once, and an optional LRU of posteriors that survives across calls.
+        self._vae_posteriors = {}
+        self._vae_latent_cache = None
+
+        # Deep UNet features reused across denoising steps, see `enable_deep_cache`.
+        self._deep_cache = None
+
+        # (tile size, tile overlap) in latent pixels, see `enable_tiled_diffusion`.
+        self._tiled_diffusion = None
+
+        # Scheduler the pipeline was loaded with, kept once `apply_scheduler_preset` swaps it out.
+        self._default_scheduler = None
+
+        # Autocast dtype of the denoising loop, see `enable_autocast`.
+        self._autocast_dtype = None
+
+        # Text-encoder outputs of previously seen prompts. Lets the pipeline run without its text encoders once the
+        # prompts it will be called with have been cached (see `from_pretrained_with_custom_modules`).
+        self.prompt_cache = PromptEmbeddingCache()
+
+    def to(self, *args, **kwargs):
+        pipe = super().to(*args, **kwargs)
+        self._keep_vae_upcast()
+        return pipe
+
+    def _keep_vae_upcast(self):
+        # A VAE that overflows in float16 (`force_upcast`) is held in float32 for good instead of being converted
+        # back and forth around every encode and decode.
+        if self.vae is not None and self.vae.config.force_upcast and self.vae.dtype == torch.float16:
+            self.vae.to(dtype=torch.float32)
+
+    def enable_vae_latent_cache(self, max_size: int = 32):
+        r"""
+        Keep the VAE posteriors of the last `max_size` input images, keyed by image content and resolution. Running
+        the same image again (e.g. with a different mask) then skips the VAE encoder entirely.
+        """
+        self._vae_latent_cache = LRUCache(max_size)
+
+    def disable_vae_latent_cache(self):
+        r"""
+        Drop the VAE latent cache enabled with `enable_vae_latent_cache`.
+        """
+        self._vae_latent_cache = None
+
+    def enable_deep_cache(self, cache_interval: int = 3):
+        r"""
+        Reuse the deep UNet features for `cache_interval - 1` steps after every full UNet pass and only run the
+        outermost UNet blocks in between (DeepCache). The last denoising step always runs the full UNet, so attention
+        guided fusion still records a real attention map.
+        """
+        self._deep_cache = UNetFeatureCache(self.unet, cache_interval=cache_interval)
+
+    def disable_deep_cache(self):
+        r"""
+        Run the full UNet on every step again.
+        """
+        self._deep_cache = None
+
+    def enable_tiled_diffusion(self, tile_size: int = 1024, tile_overlap: int = 256):
+        r"""
+        Denoise images that are larger than `tile_size` pixels on a side in overlapping `tile_size` windows, and only
+        run the windows that touch the mask (grown by `tile_overlap`). The latents of the other windows stay the
+        encoded input image, so the UNet cost follows the mask area instead of the image size. The predictions of
+        overlapping windows are blended with linear ramps.
+
+        Also switches the VAE to tiled encoding and decoding with the same tile size and overlap.
+        """
+        if tile_size % (4 * self.vae_scale_factor) != 0:
+            raise ValueError(f"`tile_size` has to be a multiple of {4 * self.vae_scale_factor} but is {tile_size}.")
+        if tile_overlap % (2 * self.vae_scale_factor) != 0 or not 0 <= tile_overlap < tile_size:
+            raise ValueError(
+                f"`tile_overlap` has to be a multiple of {2 * self.vae_scale_factor} smaller than `tile_size` but is"
+                f" {tile_overlap}."
+            )
+        self._tiled_diffusion = (tile_size // self.vae_scale_factor, tile_overlap // self.vae_scale_factor)
+
+        self.vae.tile_sample_min_size = tile_size
+        self.vae.tile_latent_min_size = tile_size // self.vae_scale_factor
+        self.vae.tile_overlap_factor = tile_overlap / tile_size
+        self.vae.enable_tiling()
+
+    def disable_tiled_diffusion(self):
+        r"""
+        Run the UNet and the VAE on the whole image again.
+        """
+        self._tiled_diffusion = None
+        self.vae.disable_tiling()
+
+    def enable_autocast(self, dtype: torch.dtype = torch.bfloat16):
+        r"""
+        Run the denoising loop under `torch.autocast` with `dtype`, e.g. bfloat16 over float32 weights on CPUs with
+        bfloat16 kernels. The VAE and the encoders outside of the loop keep running in their own dtype.
+        """
+        self._autocast_dtype = dtype
+
+    def disable_autocast(self):
+        r"""
+        Run the denoising loop in the dtype of the UNet weights again.
+        """
+        self._autocast_dtype = None
+
+    def _autocast(self, device):
+        if self._autocast_dtype is None:
+            return contextlib.nullcontext()
+        return torch.autocast(device_type=torch.device(device).type, dtype=self._autocast_dtype)
+
+    def enable_compiled_inference(self, cache_dir: Optional[str] = None, mode: Optional[str] = None):
+        r"""
+        Fuse the attention QKV projections, switch the UNet and VAE to channels_last and compile the UNet and the VAE
+        decoder with `torch.compile`.
+
+        Compiled graphs are written to the inductor FX graph cache in `cache_dir` (or the inductor default), so a new
+        process with the same code and shapes loads them instead of compiling again. Compilation itself happens
+        lazily on the first call for every input shape, which is why workers should warm the pipeline up first.
+        """
+        import torch._dynamo
+        import torch._inductor.config
+
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            os.environ["TORCHINDUCTOR_CACHE_DIR"] = cache_dir
+        torch._inductor.config.fx_graph_cache = True
+        # one graph per shape bucket, batch size and guidance/capture variant
+        torch._dynamo.config.cache_size_limit = max(torch._dynamo.config.cache_size_limit, 64)
+
+        self.fuse_qkv_projections()
+        # fusing replaced every attention processor, the attention map capture included
+        if self.config.apply_attention_guided_fusion:
+            self.get_attn_map_processor()
+
+        self.unet.to(memory_format=torch.channels_last)
+        self.vae.to(memory_format=torch.channels_last)
+        self.unet.compile(mode=mode)
+        self.vae.decoder.compile(mode=mode)
+
+    def quantize_int8(self, conv_weights: bool = False):
+        r"""
+        Quantize the Linear layers of the UNet, the text encoders and the image prompt encoder to int8 dynamic
+        quantization (int8 weights, activations quantized on the fly), and with `conv_weights=True` also keep the UNet
+        convolution weights in int8. The VAE is left in full precision.
+
+        Dynamic quantization only runs on CPU in float32, so the pipeline has to be loaded with
+        `torch_dtype=torch.float32` and stay on CPU afterwards.
+        """
+        if self.unet.device.type != "cpu" or self.unet.dtype != torch.float32:
+            raise ValueError(
+                f"int8 quantization needs a float32 pipeline on CPU, but the UNet is {self.unet.dtype} on {self.unet.device}."
+            )
+
+        for name in ("unet", "text_encoder", "text_encoder_2", "image_prompt_encoder"):
+            module = getattr(self, name, None)
+            if module is not None:
+                quantize_linear_int8(module)
+        if conv_weights:
+            quantize_conv_weights_int8(self.unet)
+
+    def apply_scheduler_preset(self, name: str) -> Dict[str, Any]:
+        r"""
+        Switch to the scheduler of the preset `name` (one of `SCHEDULER_PRESETS`) and return the `__call__` arguments
+        (`num_inference_steps`, `guidance_scale`, `guidance_steps`) that go with it. The new scheduler is built
+        from the config of the scheduler the pipeline was loaded with, so presets can be applied in any order.
+        """
+        if name not in SCHEDULER_PRESETS:
+            raise ValueError(f"Unknown scheduler preset {name!r}, choose one of {sorted(SCHEDULER_PRESETS)}.")
+        preset = SCHEDULER_PRESETS[name]
+
+        if self._default_scheduler is None:
+            self._default_scheduler = self.scheduler
+        if preset.scheduler is None:
+            self.scheduler = self._default_scheduler
+        else:
+            scheduler_cls = getattr(schedulers, preset.scheduler)
+            self.scheduler = scheduler_cls.from_config(self._default_scheduler.config, **preset.scheduler_kwargs)
+        return preset.call_kwargs()
 
 
     @classmethod
@@ -475,14 +675,44 @@ class ObjectClearPipeline(
         torch_dtype=torch.float32,
         cache_dir=None,
         variant=None,
+        load_text_encoders=True,
+        prompt_cache_path=None,
+        use_compile=False,
+        compile_cache_dir=None,
+        quantize=None,
+        precision=None,
         **kwargs,
     ):
+        r"""
+        Load the pipeline together with its `image_prompt_encoder` and `postfuse_module`.
+
+        With `load_text_encoders=False` the two text encoders and tokenizers are not loaded at all and every prompt has
+        to be served from the prompt-embedding cache, which can be read from `prompt_cache_path` (see
+        `PromptEmbeddingCache.save`).
+
+        With `use_compile=True` the pipeline is prepared with `enable_compiled_inference`, keeping the compiled
+        artifacts in `compile_cache_dir`.
+
+        `quantize="int8"` quantizes the Linear layers of the UNet and the text/image encoders to int8 with
+        `quantize_int8`, `quantize="int8-conv"` additionally stores the UNet convolution weights in int8. Both need
+        `torch_dtype=torch.float32` and a CPU device.
+
+        A [`PrecisionPolicy`] passed as `precision` (see `select_precision`) overrides `torch_dtype` and `variant`,
+        keeps the VAE in its `vae_dtype` and enables autocast for the denoising loop if the policy asks for it.
+        """
         from safetensors.torch import load_file
         from huggingface_hub import hf_hub_download
 
+        if precision is not None:
+            torch_dtype = precision.torch_dtype
+            variant = precision.variant
+
+        # the custom modules are pinned to the same revision as the rest of the pipeline
+        revision = kwargs.get("revision")
         image_prompt_encoder = CLIPImageEncoder.from_pretrained(
             pretrained_model_name_or_path,
             cache_dir=cache_dir,
+            revision=revision,
         )
 
         postfuse_module = PostfuseModule(embed_dim=2048, embed_dim_img=768)
@@ -493,12 +723,17 @@ class ObjectClearPipeline(
                 repo_id="jixin0101/ObjectClear",      
                 filename=filename,
                 subfolder="postfuse_module",            
-                cache_dir=cache_dir                     
+                cache_dir=cache_dir,
+                revision=revision,
             )
         else:
             safetensor_path = os.path.join(pretrained_model_name_or_path, sub_folder, filename)
         state_dict_postfuse = load_file(safetensor_path)
         postfuse_module.load_state_dict(state_dict_postfuse)
+
+        if not load_text_encoders:
+            for name in ("text_encoder", "text_encoder_2", "tokenizer", "tokenizer_2"):
+                kwargs.setdefault(name, None)
         
         pipe = super().from_pretrained(
             pretrained_model_name_or_path,
@@ -513,6 +748,22 @@ class ObjectClearPipeline(
         if torch_dtype is not None:
             pipe.to(dtype=torch_dtype)
 
+        if precision is not None:
+            pipe.vae.to(dtype=precision.vae_dtype)
+            if precision.autocast_dtype is not None:
+                pipe.enable_autocast(precision.autocast_dtype)
+
+        if prompt_cache_path is not None:
+            pipe.prompt_cache = PromptEmbeddingCache.load(prompt_cache_path)
+
+        if quantize is not None:
+            if quantize not in ("int8", "int8-conv"):
+                raise ValueError(f"`quantize` has to be one of None, 'int8' or 'int8-conv' but is {quantize!r}.")
+            pipe.quantize_int8(conv_weights=quantize == "int8-conv")
+
+        if use_compile:
+            pipe.enable_compiled_inference(cache_dir=compile_cache_dir)
+
         return pipe
     
     # Copied from diffusers.pipelines.stable_diffusion.pipeline_stable_diffusion.StableDiffusionPipeline.encode_image
@@ -540,66 +791,69 @@ class ObjectClearPipeline(
 
             return image_embeds, uncond_image_embeds
         
-    def unet_store_cross_attention_scores(self, unet, attention_scores, applicable_layers=None):
-        from diffusers.models.attention_processor import (
-            Attention,
-            AttnProcessor,
-            AttnProcessor2_0,
-        )
-        import types
-
-        TARGET_LAYER = "down_blocks.1.attentions.0.transformer_blocks.0.attn2"  
-        original_state = {} 
-
-        def make_new_get_attention_scores_fn(name):
-            def new_get_attention_scores(module, query, key, attention_mask=None):
-                attention_probs = module.old_get_attention_scores(
-                    query, key, attention_mask
-                )
-                if name == TARGET_LAYER:
-                    attention_scores[name] = attention_probs 
-                return attention_probs
-            return new_get_attention_scores
-
-        for name, module in unet.named_modules():
-            if isinstance(module, Attention) and name == TARGET_LAYER and "attn2" in name:
-                original_state[name] = {
-                    "processor": module.processor,
-                    "get_attention_scores": module.get_attention_scores
-                }
-                if isinstance(module.processor, AttnProcessor2_0):
-                    module.set_processor(AttnProcessor())
-                module.old_get_attention_scores = module.get_attention_scores
-                module.new_get_attention_scores = types.MethodType(
-                    make_new_get_attention_scores_fn(name), module
-                )
-                module.get_attention_scores = module.new_get_attention_scores
-
-        return unet, original_state 
-
-    def unet_restore_attention_processor(self, unet, original_state):
-        from diffusers.models.attention_processor import Attention
-
-        for name, module in unet.named_modules():
-            if isinstance(module, Attention) and "attn2" in name and name in original_state:
-                module.get_attention_scores = original_state[name]["get_attention_scores"]
-                module.set_processor(original_state[name]["processor"])
-                if hasattr(module, "old_get_attention_scores"):
-                    delattr(module, "old_get_attention_scores")
-                if hasattr(module, "new_get_attention_scores"):
-                    delattr(module, "new_get_attention_scores")
-        return unet
-    
-    def resize_attn_map_divide2(self, attn_map, mask, fuse_index):
-        bxh, num_noise_latents, num_text_tokens = attn_map.shape
+    def get_attn_map_processor(self) -> AttnMapCaptureProcessor:
+        r"""
+        Return the processor recording the attention map used by attention guided fusion, installing it on
+        `ATTN_MAP_LAYER` if the UNet's processors were replaced since the last call.
+        """
+        module = self.unet.get_submodule(ATTN_MAP_LAYER)
+        if not isinstance(module.processor, AttnMapCaptureProcessor):
+            module.set_processor(AttnMapCaptureProcessor(token_index=FUSE_INDEX))
+        module.processor.armed = False
+        return module.processor
+
+    def predict_noise_tiled(
+        self, tiles, weights, step, sample, timestep, attn_map_processor=None, deep_caches=None, full=False, **kwargs
+    ):
+        r"""
+        Run the UNet on every tile of `sample` and blend the predictions with `weights`. Latents outside of all tiles
+        get a zero prediction. If `attn_map_processor` is armed, the attention maps of the tiles are blended the same
+        way into one map over the whole latent, in the layout `resize_attn_map_divide2` expects.
+        """
+        b, _, H, W = sample.shape
+        noise_pred = sample.new_zeros(b, self.unet.config.out_channels, H, W)
+        weight_sum = sample.new_zeros(1, 1, H, W)
+        record_attn = attn_map_processor is not None and attn_map_processor.armed
+        if record_attn:
+            attn_map = torch.zeros(b, 1, H // 2, W // 2, device=sample.device)
+            attn_weight_sum = torch.zeros(1, 1, H // 2, W // 2, device=sample.device)
+
+        for k, (tile, tile_weight) in enumerate(zip(tiles, weights)):
+            rows, cols = tile.slices
+            if deep_caches is not None:
+                pred = deep_caches[k](step, sample[:, :, rows, cols], timestep, full=full, **kwargs)
+            else:
+                pred = self.unet(sample[:, :, rows, cols], timestep, return_dict=False, **kwargs)[0]
+            noise_pred[:, :, rows, cols] += pred.to(noise_pred.dtype) * tile_weight
+            weight_sum[:, :, rows, cols] += tile_weight
+
+            if record_attn:
+                half_rows = slice(tile.top // 2, (tile.top + tile.height) // 2)
+                half_cols = slice(tile.left // 2, (tile.left + tile.width) // 2)
+                half_weight = tile_weight[:, :, ::2, ::2].float()
+                tile_attn = attn_map_processor.attn_map.view(b, 1, tile.height // 2, tile.width // 2).float()
+                attn_map[:, :, half_rows, half_cols] += tile_attn * half_weight
+                attn_weight_sum[:, :, half_rows, half_cols] += half_weight
+
+        noise_pred = noise_pred / weight_sum.clamp(min=1e-8)
+
+        if record_attn:
+            covered = attn_weight_sum > 0
+            attn_map = attn_map / attn_weight_sum.clamp(min=1e-8)
+            # latents outside of the tiles get the lowest attention of the covered ones, which the min/max
+            # normalisation of `resize_attn_map_divide2` then maps to 0
+            if covered.any():
+                low = attn_map.masked_fill(~covered, float("inf")).amin(dim=(2, 3), keepdim=True)
+                attn_map = torch.where(covered, attn_map, low)
+            attn_map_processor.attn_map = attn_map.flatten(1)
+
+        return noise_pred
+
+    def resize_attn_map_divide2(self, attn_map, mask):
         b, max_num_objects, H, W = mask.shape
-        target_tokens = H * W
-        
-        attn_map = attn_map[:, :, fuse_index:fuse_index+1]
-        # attn_size = int(num_noise_latents**0.5)
-        num_heads = bxh // b
-        attn_map = attn_map.view(b, num_heads, H//2, W//2)
-        attn_map = attn_map.mean(dim=1, keepdim=True)
+
+        # `attn_map` holds the head-averaged attention to the fuse token at half the latent resolution
+        attn_map = attn_map.view(b, 1, H//2, W//2)
         attn_map = F.interpolate(attn_map, size=(H, W), mode='bilinear', align_corners=False)
         
         min_val = attn_map.amin(dim=(2, 3), keepdim=True)
@@ -610,12 +864,6 @@ class ObjectClearPipeline(
         
         
 
-    def clear_cross_attention_scores(self, cross_attention_scores):
-        keys = list(cross_attention_scores.keys())
-        for k in keys:
-            del cross_attention_scores[k]
-        gc.collect()
-
     # Copied from diffusers.pipelines.stable_diffusion.pipeline_stable_diffusion.StableDiffusionPipeline.prepare_ip_adapter_image_embeds
     def prepare_ip_adapter_image_embeds(
         self, ip_adapter_image, ip_adapter_image_embeds, device, num_images_per_prompt, do_classifier_free_guidance
@@ -904,6 +1152,66 @@ class ObjectClearPipeline(
 
         return prompt_embeds, negative_prompt_embeds, pooled_prompt_embeds, negative_pooled_prompt_embeds
 
+    def cache_prompt_embeds(
+        self,
+        prompt: Union[str, List[str]],
+        prompt_2: Optional[Union[str, List[str]]] = None,
+        negative_prompt: Optional[Union[str, List[str]]] = None,
+        negative_prompt_2: Optional[Union[str, List[str]]] = None,
+        clip_skip: Optional[int] = None,
+        num_images_per_prompt: int = 1,
+        device: Optional[torch.device] = None,
+    ):
+        r"""
+        Same as `encode_prompt` with classifier free guidance, but every prompt is looked up in `self.prompt_cache`
+        first and only encoded (and then stored) on a miss.
+
+        Returns:
+            `tuple`: `(prompt_embeds, negative_prompt_embeds, pooled_prompt_embeds, negative_pooled_prompt_embeds)`.
+        """
+        device = device or self.unet.device
+        prompts = [prompt] if isinstance(prompt, str) else prompt
+
+        def per_prompt(value):
+            if value is None or isinstance(value, str):
+                return [value] * len(prompts)
+            return value
+
+        if self.text_encoder_2 is not None:
+            dtype = self.text_encoder_2.dtype
+        else:
+            dtype = self.unet.dtype
+
+        entries = []
+        for p, p_2, n, n_2 in zip(
+            prompts, per_prompt(prompt_2), per_prompt(negative_prompt), per_prompt(negative_prompt_2)
+        ):
+            key = self.prompt_cache.make_key(p, p_2, n, n_2, clip_skip)
+            entry = self.prompt_cache.get(key, dtype)
+            if entry is None:
+                if self.text_encoder_2 is None:
+                    raise ValueError(
+                        f"No cached embeddings for prompt {p!r} and the pipeline was loaded without text encoders."
+                        " Build the prompt cache with the text encoders loaded and pass it as `prompt_cache_path`."
+                    )
+                entry = self.encode_prompt(
+                    prompt=p,
+                    prompt_2=p_2,
+                    device=device,
+                    num_images_per_prompt=1,
+                    do_classifier_free_guidance=True,
+                    negative_prompt=n,
+                    negative_prompt_2=n_2,
+                    clip_skip=clip_skip,
+                )
+                self.prompt_cache.put(key, dtype, entry)
+            entries.append(entry)
+
+        return tuple(
+            torch.cat([entry[i] for entry in entries], dim=0).to(device).repeat_interleave(num_images_per_prompt, dim=0)
+            for i in range(4)
+        )
+
     # Copied from diffusers.pipelines.stable_diffusion.pipeline_stable_diffusion.StableDiffusionPipeline.prepare_extra_step_kwargs
     def prepare_extra_step_kwargs(self, generator, eta):
         # prepare extra kwargs for the scheduler step, since not all schedulers have the same signature
@@ -922,6 +1230,30 @@ class ObjectClearPipeline(
             extra_step_kwargs["generator"] = generator
         return extra_step_kwargs
 
+    def content_generators(self, image, mask_image, seed, num_images_per_prompt=1, device="cpu"):
+        r"""
+        One generator per output image, seeded from `seed` and the content of the image/mask pair it belongs to.
+        """
+        num_images = self._get_num_images(image)
+        images = list(image) if num_images > 1 or isinstance(image, list) else [image]
+        if isinstance(mask_image, list) or self._get_num_images(mask_image) > 1:
+            masks = list(mask_image)
+        else:
+            masks = [mask_image] * num_images
+        return [
+            content_generator(seed, content_digest(i, m, str(k)), device=device)
+            for i, m in zip(images, masks)
+            for k in range(num_images_per_prompt)
+        ]
+
+    @staticmethod
+    def _get_num_images(image) -> int:
+        if isinstance(image, list):
+            return len(image)
+        if isinstance(image, (torch.Tensor, np.ndarray)) and image.ndim == 4:
+            return image.shape[0]
+        return 1
+
     def check_inputs(
         self,
         prompt,
@@ -998,12 +1330,31 @@ class ObjectClearPipeline(
                     f" got: `prompt_embeds` {prompt_embeds.shape} != `negative_prompt_embeds`"
                     f" {negative_prompt_embeds.shape}."
                 )
+        num_images = self._get_num_images(image)
+        if num_images > 1:
+            if self._get_num_images(mask_image) not in (1, num_images):
+                raise ValueError(
+                    f"`mask_image` has to be a single mask or one mask per image, but got"
+                    f" {self._get_num_images(mask_image)} masks for {num_images} images."
+                )
+            if isinstance(prompt, list) and len(prompt) != num_images:
+                raise ValueError(
+                    f"`prompt` has to be a single prompt or one prompt per image, but got {len(prompt)} prompts for"
+                    f" {num_images} images."
+                )
+            if prompt_embeds is not None and prompt_embeds.shape[0] != num_images:
+                raise ValueError(
+                    f"`prompt_embeds` has batch size {prompt_embeds.shape[0]}, but {num_images} images were passed."
+                )
+
         if padding_mask_crop is not None:
-            if not isinstance(image, PIL.Image.Image):
+            images = image if isinstance(image, list) else [image]
+            mask_images = mask_image if isinstance(mask_image, list) else [mask_image]
+            if not all(isinstance(i, PIL.Image.Image) for i in images):
                 raise ValueError(
                     f"The image should be a PIL image when inpainting mask crop, but is of type" f" {type(image)}."
                 )
-            if not isinstance(mask_image, PIL.Image.Image):
+            if not all(isinstance(m, PIL.Image.Image) for m in mask_images):
                 raise ValueError(
                     f"The mask image should be a PIL image when inpainting mask crop, but is of type"
                     f" {type(mask_image)}."
@@ -1063,11 +1414,11 @@ class ObjectClearPipeline(
 
         if image.shape[1] == 4:
             image_latents = image.to(device=device, dtype=dtype)
-            image_latents = image_latents.repeat(batch_size // image_latents.shape[0], 1, 1, 1)
+            image_latents = image_latents.repeat_interleave(batch_size // image_latents.shape[0], dim=0)
         elif return_image_latents or (latents is None and not is_strength_max):
             image = image.to(device=device, dtype=dtype)
             image_latents = self._encode_vae_image(image=image, generator=generator)
-            image_latents = image_latents.repeat(batch_size // image_latents.shape[0], 1, 1, 1)
+            image_latents = image_latents.repeat_interleave(batch_size // image_latents.shape[0], dim=0)
 
         if latents is None and add_noise:
             noise = randn_tensor(shape, generator=generator, device=device, dtype=dtype)
@@ -1094,27 +1445,50 @@ class ObjectClearPipeline(
 
     def _encode_vae_image(self, image: torch.Tensor, generator: torch.Generator):
         dtype = image.dtype
-        if self.vae.config.force_upcast:
-            image = image.float()
-            self.vae.to(dtype=torch.float32)
+        # the VAE stays in its own precision (see `to`), only the input is cast
+        image = image.to(self.vae.dtype)
+
+        posterior = self._vae_encode(image)
 
         if isinstance(generator, list):
             image_latents = [
-                retrieve_latents(self.vae.encode(image[i : i + 1]), generator=generator[i])
+                DiagonalGaussianDistribution(posterior.parameters[i : i + 1]).sample(generator=generator[i])
                 for i in range(image.shape[0])
             ]
             image_latents = torch.cat(image_latents, dim=0)
         else:
-            image_latents = retrieve_latents(self.vae.encode(image), generator=generator)
-
-        if self.vae.config.force_upcast:
-            self.vae.to(dtype)
+            image_latents = posterior.sample(generator=generator)
 
         image_latents = image_latents.to(dtype)
         image_latents = self.vae.config.scaling_factor * image_latents
 
         return image_latents
 
+    def _vae_encode(self, image: torch.Tensor) -> DiagonalGaussianDistribution:
+        # Only the deterministic encoder pass is shared; sampling from the posterior still happens per caller with
+        # its own generator, so results match encoding every input separately.
+        keys = [tensor_digest(image[i : i + 1]) for i in range(image.shape[0])]
+        parameters = [None] * len(keys)
+        missing = []
+        for i, key in enumerate(keys):
+            cached = self._vae_posteriors.get(key)
+            if cached is None and self._vae_latent_cache is not None:
+                cached = self._vae_latent_cache.get(key)
+            if cached is None:
+                missing.append(i)
+            else:
+                parameters[i] = cached.to(device=image.device)
+
+        if missing:
+            encoded = self.vae.encode(image[missing]).latent_dist.parameters
+            for i, params in zip(missing, encoded.split(1)):
+                parameters[i] = params
+                self._vae_posteriors[keys[i]] = params
+                if self._vae_latent_cache is not None:
+                    self._vae_latent_cache.put(keys[i], params)
+
+        return DiagonalGaussianDistribution(torch.cat(parameters, dim=0))
+
     def prepare_mask_latents(
         self, mask, masked_image, batch_size, height, width, dtype, device, generator, do_classifier_free_guidance
     ):
@@ -1134,7 +1508,7 @@ class ObjectClearPipeline(
                     f" a total batch size of {batch_size}, but {mask.shape[0]} masks were passed. Make sure the number"
                     " of masks that you pass is divisible by the total requested batch size."
                 )
-            mask = mask.repeat(batch_size // mask.shape[0], 1, 1, 1)
+            mask = mask.repeat_interleave(batch_size // mask.shape[0], dim=0)
 
         mask = torch.cat([mask] * 2) if do_classifier_free_guidance else mask
 
@@ -1155,8 +1529,8 @@ class ObjectClearPipeline(
                         f" to a total batch size of {batch_size}, but {masked_image_latents.shape[0]} images were passed."
                         " Make sure the number of images that you pass is divisible by the total requested batch size."
                     )
-                masked_image_latents = masked_image_latents.repeat(
-                    batch_size // masked_image_latents.shape[0], 1, 1, 1
+                masked_image_latents = masked_image_latents.repeat_interleave(
+                    batch_size // masked_image_latents.shape[0], dim=0
                 )
 
             masked_image_latents = (
@@ -1327,6 +1701,20 @@ class ObjectClearPipeline(
     def do_classifier_free_guidance(self):
         return self._guidance_scale > 1 and self.unet.config.time_cond_proj_dim is None
 
+    def do_classifier_free_guidance_at(self, step_index, timestep):
+        r"""
+        Whether classifier free guidance is applied on denoising step `step_index` with timestep `timestep`, given the
+        `guidance_steps` and `guidance_interval` the pipeline was called with.
+        """
+        if not self.do_classifier_free_guidance:
+            return False
+        if self._guidance_steps is not None and step_index >= self._guidance_steps:
+            return False
+        if self._guidance_interval is not None:
+            low, high = self._guidance_interval
+            return low <= float(timestep) <= high
+        return True
+
     @property
     def cross_attention_kwargs(self):
         return self._cross_attention_kwargs
@@ -1366,11 +1754,14 @@ class ObjectClearPipeline(
         denoising_start: Optional[float] = None,
         denoising_end: Optional[float] = None,
         guidance_scale: float = 7.5,
+        guidance_steps: Optional[int] = None,
+        guidance_interval: Optional[Tuple[float, float]] = None,
         negative_prompt: Optional[Union[str, List[str]]] = None,
         negative_prompt_2: Optional[Union[str, List[str]]] = None,
         num_images_per_prompt: Optional[int] = 1,
         eta: float = 0.0,
         generator: Optional[Union[torch.Generator, List[torch.Generator]]] = None,
+        seed: Optional[int] = None,
         latents: Optional[torch.Tensor] = None,
         prompt_embeds: Optional[torch.Tensor] = None,
         negative_prompt_embeds: Optional[torch.Tensor] = None,
@@ -1408,14 +1799,17 @@ class ObjectClearPipeline(
             prompt_2 (`str` or `List[str]`, *optional*):
                 The prompt or prompts to be sent to the `tokenizer_2` and `text_encoder_2`. If not defined, `prompt` is
                 used in both text-encoders
-            image (`PIL.Image.Image`):
+            image (`PIL.Image.Image` or `List[PIL.Image.Image]`):
                 `Image`, or tensor representing an image batch which will be inpainted, *i.e.* parts of the image will
-                be masked out with `mask_image` and repainted according to `prompt`.
-            mask_image (`PIL.Image.Image`):
+                be masked out with `mask_image` and repainted according to `prompt`. A list of images is processed as
+                one batch (one UNet forward per step for all of them); all images are resized to `height` x `width`,
+                so they should share the same size. A single `prompt` is used for every image of the batch.
+            mask_image (`PIL.Image.Image` or `List[PIL.Image.Image]`):
                 `Image`, or tensor representing an image batch, to mask `image`. White pixels in the mask will be
                 repainted, while black pixels will be preserved. If `mask_image` is a PIL image, it will be converted
                 to a single channel (luminance) before use. If it's a tensor, it should contain one color channel (L)
-                instead of 3, so the expected shape would be `(B, H, W, 1)`.
+                instead of 3, so the expected shape would be `(B, H, W, 1)`. For a batch of images, pass either one
+                mask per image or a single mask shared by all of them.
             height (`int`, *optional*, defaults to self.unet.config.sample_size * self.vae_scale_factor):
                 The height in pixels of the generated image. This is set to 1024 by default for the best results.
                 Anything below 512 pixels won't work well for
@@ -1431,8 +1825,11 @@ class ObjectClearPipeline(
                 image and mask_image. If `padding_mask_crop` is not `None`, it will first find a rectangular region
                 with the same aspect ration of the image and contains all masked area, and then expand that area based
                 on `padding_mask_crop`. The image and mask_image will then be cropped based on the expanded area before
-                resizing to the original image size for inpainting. This is useful when the masked area is small while
-                the image is large and contain information irrelevant for inpainting, such as background.
+                resizing to `height` x `width` for inpainting. This is useful when the masked area is small while
+                the image is large and contain information irrelevant for inpainting, such as background. The denoised
+                window (after attention guided fusion, if enabled) is pasted back into the full-size `image` with a
+                feathered border, so the returned images have the size of the inputs. Each image of a batch gets its
+                own window.
             strength (`float`, *optional*, defaults to 0.9999):
                 Conceptually, indicates how much to transform the masked portion of the reference `image`. Must be
                 between 0 and 1. `image` will be used as a starting point, adding more noise to it the larger the
@@ -1473,6 +1870,12 @@ class ObjectClearPipeline(
                 Paper](https://arxiv.org/pdf/2205.11487.pdf). Guidance scale is enabled by setting `guidance_scale >
                 1`. Higher guidance scale encourages to generate images that are closely linked to the text `prompt`,
                 usually at the expense of lower image quality.
+            guidance_steps (`int`, *optional*):
+                Only apply classifier free guidance for the first `guidance_steps` denoising steps. The remaining steps
+                run the UNet on the conditional batch alone. If not defined, guidance is applied on every step.
+            guidance_interval (`Tuple[float, float]`, *optional*):
+                Only apply classifier free guidance while the timestep `t` satisfies `low <= t <= high`. Can be
+                combined with `guidance_steps`, in which case both have to hold.
             negative_prompt (`str` or `List[str]`, *optional*):
                 The prompt or prompts not to guide the image generation. If not defined, one has to pass
                 `negative_prompt_embeds` instead. Ignored when not using guidance (i.e., ignored if `guidance_scale` is
@@ -1508,6 +1911,10 @@ class ObjectClearPipeline(
             generator (`torch.Generator`, *optional*):
                 One or a list of [torch generator(s)](https://pytorch.org/docs/stable/generated/torch.Generator.html)
                 to make generation deterministic.
+            seed (`int`, *optional*):
+                Used when no `generator` is passed: every output image gets its own generator, seeded from `seed` and
+                the content of its image and mask (see `content_generators`). The result of an input then neither
+                depends on the batch it runs in nor on earlier calls.
             latents (`torch.Tensor`, *optional*):
                 Pre-generated noisy latents, sampled from a Gaussian distribution, to be used as inputs for image
                 generation. Can be used to tweak the same generation with different prompts. If not provided, a latents
@@ -1624,15 +2031,26 @@ class ObjectClearPipeline(
             padding_mask_crop,
         )
 
+        if guidance_interval is not None and guidance_interval[0] > guidance_interval[1]:
+            raise ValueError(f"`guidance_interval` has to be given as (low, high) but is {guidance_interval}.")
+
         self._guidance_scale = guidance_scale
+        self._guidance_steps = guidance_steps
+        self._guidance_interval = guidance_interval
         self._guidance_rescale = guidance_rescale
         self._clip_skip = clip_skip
         self._cross_attention_kwargs = cross_attention_kwargs
         self._denoising_end = denoising_end
         self._denoising_start = denoising_start
         self._interrupt = False
+        self._vae_posteriors = {}
 
         # 2. Define call parameters
+        # a single prompt is shared by every image of a batched call
+        num_images = self._get_num_images(image)
+        if prompt is not None and isinstance(prompt, str) and num_images > 1:
+            prompt = [prompt] * num_images
+
         if prompt is not None and isinstance(prompt, str):
             batch_size = 1
         elif prompt is not None and isinstance(prompt, list):
@@ -1643,31 +2061,59 @@ class ObjectClearPipeline(
         # device = self._execution_device
         device = self.unet.device
 
+        if generator is None and seed is not None:
+            generator = self.content_generators(image, mask_image, seed, num_images_per_prompt, device=device)
+
         # 3. Encode input prompt
         text_encoder_lora_scale = (
             self.cross_attention_kwargs.get("scale", None) if self.cross_attention_kwargs is not None else None
         )
 
-        (
-            prompt_embeds,
-            negative_prompt_embeds,
-            pooled_prompt_embeds,
-            negative_pooled_prompt_embeds,
-        ) = self.encode_prompt(
-            prompt=prompt,
-            prompt_2=prompt_2,
-            device=device,
-            num_images_per_prompt=num_images_per_prompt,
-            do_classifier_free_guidance=self.do_classifier_free_guidance,
-            negative_prompt=negative_prompt,
-            negative_prompt_2=negative_prompt_2,
-            prompt_embeds=prompt_embeds,
-            negative_prompt_embeds=negative_prompt_embeds,
-            pooled_prompt_embeds=pooled_prompt_embeds,
-            negative_pooled_prompt_embeds=negative_pooled_prompt_embeds,
-            lora_scale=text_encoder_lora_scale,
-            clip_skip=self.clip_skip,
+        use_prompt_cache = text_encoder_lora_scale is None and all(
+            embeds is None
+            for embeds in (
+                prompt_embeds,
+                negative_prompt_embeds,
+                pooled_prompt_embeds,
+                negative_pooled_prompt_embeds,
+            )
         )
+        if use_prompt_cache:
+            (
+                prompt_embeds,
+                negative_prompt_embeds,
+                pooled_prompt_embeds,
+                negative_pooled_prompt_embeds,
+            ) = self.cache_prompt_embeds(
+                prompt=prompt,
+                prompt_2=prompt_2,
+                negative_prompt=negative_prompt,
+                negative_prompt_2=negative_prompt_2,
+                clip_skip=self.clip_skip,
+                num_images_per_prompt=num_images_per_prompt,
+                device=device,
+            )
+        else:
+            (
+                prompt_embeds,
+                negative_prompt_embeds,
+                pooled_prompt_embeds,
+                negative_pooled_prompt_embeds,
+            ) = self.encode_prompt(
+                prompt=prompt,
+                prompt_2=prompt_2,
+                device=device,
+                num_images_per_prompt=num_images_per_prompt,
+                do_classifier_free_guidance=self.do_classifier_free_guidance,
+                negative_prompt=negative_prompt,
+                negative_prompt_2=negative_prompt_2,
+                prompt_embeds=prompt_embeds,
+                negative_prompt_embeds=negative_prompt_embeds,
+                pooled_prompt_embeds=pooled_prompt_embeds,
+                negative_pooled_prompt_embeds=negative_pooled_prompt_embeds,
+                lora_scale=text_encoder_lora_scale,
+                clip_skip=self.clip_skip,
+            )
 
         # 4. set timesteps
         def denoising_value_valid(dnv):
@@ -1695,22 +2141,42 @@ class ObjectClearPipeline(
 
         # 5. Preprocess mask and image
         if padding_mask_crop is not None:
-            crops_coords = self.mask_processor.get_crop_region(mask_image, width, height, pad=padding_mask_crop)
+            # every image gets its own window around its mask; the windows are all denoised at `height` x `width`
+            original_images = image if isinstance(image, list) else [image]
+            mask_images = mask_image if isinstance(mask_image, list) else [mask_image] * len(original_images)
+            crops_coords = [
+                self.mask_processor.get_crop_region(m, width, height, pad=padding_mask_crop) for m in mask_images
+            ]
             resize_mode = "fill"
+
+            init_image = torch.cat(
+                [
+                    self.image_processor.preprocess(
+                        i, height=height, width=width, crops_coords=c, resize_mode=resize_mode
+                    )
+                    for i, c in zip(original_images, crops_coords)
+                ]
+            )
+            mask = torch.cat(
+                [
+                    self.mask_processor.preprocess(
+                        m, height=height, width=width, resize_mode=resize_mode, crops_coords=c
+                    )
+                    for m, c in zip(mask_images, crops_coords)
+                ]
+            )
         else:
             crops_coords = None
             resize_mode = "default"
 
-        original_image = image
-        init_image = self.image_processor.preprocess(
-            image, height=height, width=width, crops_coords=crops_coords, resize_mode=resize_mode
-        )
+            init_image = self.image_processor.preprocess(
+                image, height=height, width=width, crops_coords=crops_coords, resize_mode=resize_mode
+            )
+            mask = self.mask_processor.preprocess(
+                mask_image, height=height, width=width, resize_mode=resize_mode, crops_coords=crops_coords
+            )
         init_image = init_image.to(dtype=torch.float32)
 
-        mask = self.mask_processor.preprocess(
-            mask_image, height=height, width=width, resize_mode=resize_mode, crops_coords=crops_coords
-        )
-
         if masked_image_latents is not None:
             masked_image = masked_image_latents
         elif init_image.shape[1] == 4:
@@ -1722,8 +2188,9 @@ class ObjectClearPipeline(
             obj_only = init_image * (mask > 0.5)
             obj_only = obj_only.to(device=device)
             object_embeds = self.image_prompt_encoder(obj_only)
+            object_embeds = object_embeds.repeat_interleave(num_images_per_prompt, dim=0)
             
-        prompt_embeds = self.postfuse_module(prompt_embeds, object_embeds, 5)
+        prompt_embeds = self.postfuse_module(prompt_embeds, object_embeds, FUSE_INDEX)
 
         # 6. Prepare latent variables
         num_channels_latents = self.vae.config.latent_channels
@@ -1874,45 +2341,111 @@ class ObjectClearPipeline(
 
         self._num_timesteps = len(timesteps)
         attn_map = None
-        with self.progress_bar(total=num_inference_steps) as progress_bar:
+        if self.config.apply_attention_guided_fusion:
+            attn_map_processor = self.get_attn_map_processor()
+        if self._deep_cache is not None:
+            self._deep_cache.reset()
+
+        # only the tiles that touch the mask are denoised, the rest keeps the encoded input image
+        tiles = None
+        if self._tiled_diffusion is not None:
+            tile_size, tile_overlap = self._tiled_diffusion
+            tiles = latent_tiles(*latents.shape[-2:], tile_size, tile_overlap)
+            if len(tiles) > 1:
+                tiles = tiles_touching_mask(tiles, mask, margin=tile_overlap)
+                weights = [tile_weights(tile, tile_overlap, device=device, dtype=latents.dtype) for tile in tiles]
+                tile_coverage = torch.zeros_like(latents[:1, :1], dtype=torch.bool)
+                for tile in tiles:
+                    tile_coverage[:, :, tile.slices[0], tile.slices[1]] = True
+                tile_deep_caches = None
+                if self._deep_cache is not None:
+                    tile_deep_caches = [
+                        UNetFeatureCache(self.unet, cache_interval=self._deep_cache.cache_interval) for _ in tiles
+                    ]
+            else:
+                tiles = None
+
+        with self.progress_bar(total=num_inference_steps) as progress_bar, self._autocast(device):
             for i, t in enumerate(timesteps):
                 if self.interrupt:
                     continue
-                # Inject cross-attention storage logic at the last timestep
+                # Record the cross-attention map at the last timestep
                 if i == len(timesteps) - 1 and self.config.apply_attention_guided_fusion:
-                    self.unet, self.original_state = self.unet_store_cross_attention_scores(
-                        self.unet, 
-                        self.cross_attention_scores
-                    )
+                    attn_map_processor.armed = True
+                # outside the guidance schedule only the conditional half of the batch is run
+                do_guidance = self.do_classifier_free_guidance_at(i, t)
+                step_prompt_embeds, step_text_embeds, step_time_ids = prompt_embeds, add_text_embeds, add_time_ids
+                step_mask, step_masked_image_latents = mask, masked_image_latents
+                if self.do_classifier_free_guidance and not do_guidance:
+                    step_prompt_embeds = prompt_embeds.chunk(2)[1]
+                    step_text_embeds = add_text_embeds.chunk(2)[1]
+                    step_time_ids = add_time_ids.chunk(2)[1]
+                    step_mask = mask.chunk(2)[1]
+                    if num_channels_unet == 9:
+                        step_masked_image_latents = masked_image_latents.chunk(2)[1]
+
                 # expand the latents if we are doing classifier free guidance
-                latent_model_input = torch.cat([latents] * 2) if self.do_classifier_free_guidance else latents
+                latent_model_input = torch.cat([latents] * 2) if do_guidance else latents
 
                 # concat latents, mask, masked_image_latents in the channel dimension
                 latent_model_input = self.scheduler.scale_model_input(latent_model_input, t)
 
                 if num_channels_unet == 9:
-                    latent_model_input = torch.cat([latent_model_input, mask, masked_image_latents], dim=1)
+                    latent_model_input = torch.cat([latent_model_input, step_mask, step_masked_image_latents], dim=1)
 
                 # predict the noise residual
-                added_cond_kwargs = {"text_embeds": add_text_embeds, "time_ids": add_time_ids}
+                added_cond_kwargs = {"text_embeds": step_text_embeds, "time_ids": step_time_ids}
                 if ip_adapter_image is not None or ip_adapter_image_embeds is not None:
-                    added_cond_kwargs["image_embeds"] = image_embeds
-                noise_pred = self.unet(
-                    latent_model_input,
-                    t,
-                    encoder_hidden_states=prompt_embeds,
-                    timestep_cond=timestep_cond,
-                    cross_attention_kwargs=self.cross_attention_kwargs,
-                    added_cond_kwargs=added_cond_kwargs,
-                    return_dict=False,
-                )[0]
+                    if self.do_classifier_free_guidance and not do_guidance:
+                        added_cond_kwargs["image_embeds"] = [embeds.chunk(2)[1] for embeds in image_embeds]
+                    else:
+                        added_cond_kwargs["image_embeds"] = image_embeds
+                if tiles is not None:
+                    noise_pred = self.predict_noise_tiled(
+                        tiles,
+                        weights,
+                        i,
+                        latent_model_input,
+                        t,
+                        attn_map_processor=attn_map_processor if self.config.apply_attention_guided_fusion else None,
+                        deep_caches=tile_deep_caches,
+                        full=i == len(timesteps) - 1,
+                        encoder_hidden_states=step_prompt_embeds,
+                        timestep_cond=timestep_cond,
+                        cross_attention_kwargs=self.cross_attention_kwargs,
+                        added_cond_kwargs=added_cond_kwargs,
+                    )
+                elif self._deep_cache is not None:
+                    noise_pred = self._deep_cache(
+                        i,
+                        latent_model_input,
+                        t,
+                        encoder_hidden_states=step_prompt_embeds,
+                        timestep_cond=timestep_cond,
+                        cross_attention_kwargs=self.cross_attention_kwargs,
+                        added_cond_kwargs=added_cond_kwargs,
+                        full=i == len(timesteps) - 1,
+                    )
+                else:
+                    noise_pred = self.unet(
+                        latent_model_input,
+                        t,
+                        encoder_hidden_states=step_prompt_embeds,
+                        timestep_cond=timestep_cond,
+                        cross_attention_kwargs=self.cross_attention_kwargs,
+                        added_cond_kwargs=added_cond_kwargs,
+                        return_dict=False,
+                    )[0]
+                if self.config.apply_attention_guided_fusion:
+                    attn_map_processor.armed = False
+                noise_pred = noise_pred.to(latents.dtype)
 
                 # perform guidance
-                if self.do_classifier_free_guidance:
+                if do_guidance:
                     noise_pred_uncond, noise_pred_text = noise_pred.chunk(2)
                     noise_pred = noise_pred_uncond + self.guidance_scale * (noise_pred_text - noise_pred_uncond)
 
-                if self.do_classifier_free_guidance and self.guidance_rescale > 0.0:
+                if do_guidance and self.guidance_rescale > 0.0:
                     # Based on 3.4. in https://arxiv.org/pdf/2305.08891.pdf
                     noise_pred = rescale_noise_cfg(noise_pred, noise_pred_text, guidance_rescale=self.guidance_rescale)
 
@@ -1925,11 +2458,13 @@ class ObjectClearPipeline(
                         latents = latents.to(latents_dtype)
 
                 # progressive attention mask blending
-                fuse_index = 5
                 if self.config.apply_attention_guided_fusion:
                     if i == 0:
                         init_latents_proper = image_latents
-                        init_mask = mask[0:1]
+                        if self.do_classifier_free_guidance:
+                            init_mask, _ = mask.chunk(2)
+                        else:
+                            init_mask = mask
 
                         noise_timestep = timesteps[i + 1]
                         init_latents_proper = self.scheduler.add_noise(
@@ -1939,21 +2474,14 @@ class ObjectClearPipeline(
                         latents = (1 - init_mask) * init_latents_proper + init_mask * latents
                         
                     if i == len(timesteps) - 1 and self.config.apply_attention_guided_fusion:
-                        attn_key, attn_map = next(iter(self.cross_attention_scores.items()))
-                        attn_map = self.resize_attn_map_divide2(attn_map, mask, fuse_index)
+                        attn_map = self.resize_attn_map_divide2(attn_map_processor.attn_map, step_mask)
+                        attn_map_processor.attn_map = None
                         init_latents_proper = image_latents
-                        if self.do_classifier_free_guidance:
+                        if do_guidance:
                             _, init_mask = attn_map.chunk(2)
                         else:
                             init_mask = attn_map
                         attn_map = init_mask
-
-                        self.unet = self.unet_restore_attention_processor(
-                            self.unet, 
-                            self.original_state
-                        )
-
-                        self.clear_cross_attention_scores(self.cross_attention_scores)
                 
                 if num_channels_unet == 4:
                     init_latents_proper = image_latents
@@ -1998,17 +2526,15 @@ class ObjectClearPipeline(
                 if XLA_AVAILABLE:
                     xm.mark_step()
 
-        if not output_type == "latent":
-            # make sure the VAE is in float32 mode, as it overflows in float16
-            needs_upcasting = self.vae.dtype == torch.float16 and self.vae.config.force_upcast
+        if self._deep_cache is not None:
+            self._deep_cache.reset()
+
+        if tiles is not None:
+            latents = torch.where(tile_coverage, latents, image_latents.to(latents.dtype))
 
-            if needs_upcasting:
-                self.upcast_vae()
-                latents = latents.to(next(iter(self.vae.post_quant_conv.parameters())).dtype)
-            elif latents.dtype != self.vae.dtype:
-                if torch.backends.mps.is_available():
-                    # some platforms (eg. apple mps) misbehave due to a pytorch bug: https://github.com/pytorch/pytorch/pull/99272
-                    self.vae = self.vae.to(latents.dtype)
+        if not output_type == "latent":
+            # the VAE is kept in float32 when it overflows in float16 (see `to`), so only the latents are cast
+            latents = latents.to(self.vae.dtype)
 
             # unscale/denormalize the latents
             # denormalize with the mean and std if available and not None
@@ -2026,10 +2552,6 @@ class ObjectClearPipeline(
                 latents = latents / self.vae.config.scaling_factor
 
             image = self.vae.decode(latents, return_dict=False)[0]
-
-            # cast back to fp16 if needed
-            if needs_upcasting:
-                self.vae.to(dtype=torch.float16)
         else:
             return ObjectClearPipelineOutput(images=latents)
 
@@ -2037,37 +2559,45 @@ class ObjectClearPipeline(
         if self.watermark is not None:
             image = self.watermark.apply_watermark(image)
 
-        image = self.image_processor.postprocess(image, output_type=output_type)
-
-        if padding_mask_crop is not None:
-            image = [self.image_processor.apply_overlay(mask_image, original_image, i, crops_coords) for i in image]
-            
         attn_pils = []
+        fuse_masks = None
         if output_type == "pil" and attn_map is not None:
-            for i in range(len(attn_map)):
-                attn_np = attn_map[i].mean(dim=0).cpu().numpy() * 255.
-                attn_pil = PIL.Image.fromarray(attn_np.astype(np.uint8)).convert("L")
-                attn_pils.append(attn_pil)
-            
-            original_pils = self.image_processor.postprocess(init_image, output_type="pil")
-
-            generated_pils = image
-
-            fused_images = []
-            for i in range(len(generated_pils)):
-                ori_pil = original_pils[i]
-                gen_pil = generated_pils[i]
-                attn_pil = attn_pils[i]
-
-                fused_np = attention_guided_fusion(np.array(ori_pil), np.array(gen_pil), np.array(attn_pil))
-                fused_pil = PIL.Image.fromarray(fused_np.astype(np.uint8)).resize(ori_pil.size)
-
-                fused_images.append(fused_pil)
+            # fuse the whole batch on tensors and only convert the result to PIL
+            original = (init_image / 2 + 0.5).clamp(0, 1).repeat_interleave(num_images_per_prompt, dim=0)
+            generated = (image / 2 + 0.5).clamp(0, 1)
+            image, fuse_mask = attention_guided_fusion_pt(original, generated, attn_map, return_mask=True)
+            image = self.image_processor.numpy_to_pil(self.image_processor.pt_to_numpy(image))
+            if padding_mask_crop is not None:
+                fuse_np = (fuse_mask[:, 0].float() * 255).round().cpu().numpy().astype(np.uint8)
+                fuse_masks = [PIL.Image.fromarray(m, mode="L") for m in fuse_np]
+
+            if return_attn_map:
+                attn_np = (attn_map.mean(dim=1) * 255.).cpu().numpy()
+                attn_pils = [PIL.Image.fromarray(a.astype(np.uint8)).convert("L") for a in attn_np]
+        else:
+            image = self.image_processor.postprocess(image, output_type=output_type)
 
-            image = fused_images
+        if padding_mask_crop is not None:
+            # only what was fused in is pasted back into the full-size original: the AGF mask (object effects outside
+            # the mask included), or without AGF the input mask, so the rest of the window keeps its original pixels
+            if fuse_masks is None:
+                fuse_masks = [
+                    mask_images[i // num_images_per_prompt].convert("L").crop(crops_coords[i // num_images_per_prompt])
+                    for i in range(len(image))
+                ]
+            image = [
+                paste_crop(
+                    original_images[i // num_images_per_prompt],
+                    img,
+                    crops_coords[i // num_images_per_prompt],
+                    mask=fuse_masks[i],
+                )
+                for i, img in enumerate(image)
+            ]
 
         # Offload all models
         self.maybe_free_model_hooks()
+        self._vae_posteriors = {}
     
         if return_attn_map and len(attn_pils) > 0:
             if not return_dict:
@@ -0,0 +1,42 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+
+@dataclass(frozen=True)
+class SchedulerPreset:
+    """
+    Scheduler swap plus the `__call__` arguments that go with it.
+
+    `scheduler` names a class of `diffusers.schedulers` that is built from the config of the pipeline's own
+    scheduler with `scheduler_kwargs` on top. `None` keeps the scheduler the pipeline was loaded with.
+    """
+    num_inference_steps: int
+    guidance_scale: float = 2.5
+    guidance_steps: Optional[int] = None
+    scheduler: Optional[str] = None
+    scheduler_kwargs: Dict[str, Any] = field(default_factory=dict)
+
+    def call_kwargs(self) -> Dict[str, Any]:
+        return {
+            "num_inference_steps": self.num_inference_steps,
+            "guidance_scale": self.guidance_scale,
+            "guidance_steps": self.guidance_steps,
+        }
+
+
+# `quality` is the 20-step baseline. The step counts and guidance of the other presets are unmeasured starting
+# points; their quality and latency delta against the baseline is measured with `evaluate_presets.py`.
+SCHEDULER_PRESETS = {
+    "quality": SchedulerPreset(num_inference_steps=20),
+    "balanced": SchedulerPreset(
+        num_inference_steps=12,
+        scheduler="DPMSolverMultistepScheduler",
+        scheduler_kwargs={"algorithm_type": "dpmsolver++", "solver_order": 2, "use_karras_sigmas": True},
+    ),
+    "fast": SchedulerPreset(
+        num_inference_steps=8,
+        guidance_steps=4,
+        scheduler="UniPCMultistepScheduler",
+        scheduler_kwargs={"solver_order": 2, "use_karras_sigmas": True},
+    ),
+}
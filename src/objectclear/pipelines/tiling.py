@@ -0,0 +1,66 @@
+from dataclasses import dataclass
+from typing import List, Tuple
+
+import torch
+import torch.nn.functional as F
+
+
+@dataclass(frozen=True)
+class LatentTile:
+    """
+    Window of the latent canvas that is run through the UNet on its own.
+    """
+    top: int
+    left: int
+    height: int
+    width: int
+
+    @property
+    def slices(self) -> Tuple[slice, slice]:
+        return slice(self.top, self.top + self.height), slice(self.left, self.left + self.width)
+
+
+def _tile_starts(length: int, tile_size: int, stride: int) -> List[int]:
+    if length <= tile_size:
+        return [0]
+    # the last tile is aligned to the far edge instead of running over it
+    return list(range(0, length - tile_size, stride)) + [length - tile_size]
+
+
+def latent_tiles(height: int, width: int, tile_size: int, overlap: int) -> List[LatentTile]:
+    """
+    Cover a `height` x `width` latent with `tile_size` tiles that overlap their neighbours by at least `overlap`.
+    A side shorter than `tile_size` is covered by a single, shorter tile.
+    """
+    stride = tile_size - overlap
+    return [
+        LatentTile(top, left, min(tile_size, height), min(tile_size, width))
+        for top in _tile_starts(height, tile_size, stride)
+        for left in _tile_starts(width, tile_size, stride)
+    ]
+
+
+def tiles_touching_mask(tiles: List[LatentTile], mask: torch.Tensor, margin: int = 0) -> List[LatentTile]:
+    """
+    Keep the tiles that intersect the (B, 1, H, W) latent `mask` of any image of the batch, after growing the mask by
+    `margin` latent pixels.
+    """
+    region = (mask > 0.5).any(dim=0, keepdim=True).float()
+    if margin > 0:
+        region = F.max_pool2d(region, kernel_size=2 * margin + 1, stride=1, padding=margin)
+    region = region[0, 0] > 0
+    return [tile for tile in tiles if region[tile.slices].any()]
+
+
+def tile_weights(tile: LatentTile, overlap: int, device=None, dtype=torch.float32) -> torch.Tensor:
+    """
+    (1, 1, h, w) blending weights of `tile`, ramping up linearly over `overlap` pixels from every edge. The weights
+    are normalised by their sum over all tiles, so the ramp has no effect where a tile has no neighbour.
+    """
+    def ramp(length):
+        position = torch.arange(length, device=device, dtype=torch.float32)
+        distance = torch.minimum(position + 1, length - position)
+        return (distance / (overlap + 1)).clamp(max=1)
+
+    weights = ramp(tile.height)[:, None] * ramp(tile.width)[None, :]
+    return weights[None, None].to(dtype)
@@ -1,5 +1,33 @@
-from .attention_guided_fusion import attention_guided_fusion
-from .image_utils import pad_to_multiple, crop_to_original, resize_by_short_side
+from .attention_guided_fusion import attention_guided_fusion, attention_guided_fusion_pt
+from .image_utils import (
+    pad_to_multiple,
+    crop_to_original,
+    resize_by_short_side,
+    short_side_size,
+    mask_crop_size,
+    paste_crop,
+)
+from .lru_cache import LRUCache, tensor_digest
+from .precision import PrecisionPolicy, select_precision
+from .prompt_cache import PromptEmbeddingCache
+from .seeding import content_digest, content_generator, content_seed
 
 
-__all__ = ["attention_guided_fusion", "pad_to_multiple", "crop_to_original", "resize_by_short_side"]
\ No newline at end of file
+__all__ = [
+    "attention_guided_fusion",
+    "attention_guided_fusion_pt",
+    "pad_to_multiple",
+    "crop_to_original",
+    "resize_by_short_side",
+    "short_side_size",
+    "mask_crop_size",
+    "paste_crop",
+    "LRUCache",
+    "tensor_digest",
+    "PrecisionPolicy",
+    "select_precision",
+    "PromptEmbeddingCache",
+    "content_digest",
+    "content_generator",
+    "content_seed",
+]
\ No newline at end of file
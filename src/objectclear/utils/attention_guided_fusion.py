@@ -1,5 +1,8 @@
+import functools
 import numpy as np
 import cv2
+import torch
+import torch.nn.functional as F
 from scipy.ndimage import convolve, zoom
 from .image_utils import pad_to_multiple, crop_to_original
 
@@ -47,6 +50,57 @@ def wavelet_color_fix_np(fused: np.ndarray, mask: np.ndarray) -> np.ndarray:
 
     return result_np
 
+# separable form of the 3x3 kernel used by `wavelet_blur_np`
+_WAVELET_KERNEL_1D = np.array([0.25, 0.5, 0.25], dtype=np.float32)
+
+@functools.lru_cache(maxsize=None)
+def ellipse_kernel(size: int) -> np.ndarray:
+    return cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (size, size))
+
+@functools.lru_cache(maxsize=32)
+def _zoom_maps(in_size, out_size):
+    # sampling grid of scipy.ndimage.zoom, which maps the corner pixels onto each other
+    coords = []
+    for n_in, n_out in zip(in_size, out_size):
+        step = (n_in - 1) / (n_out - 1) if n_out > 1 else 0.0
+        coords.append(np.arange(n_out, dtype=np.float32) * np.float32(step))
+    map_y, map_x = np.meshgrid(*coords, indexing='ij')
+    return map_x, map_y
+
+def wavelet_lowpass_cv(image: np.ndarray, levels=5) -> np.ndarray:
+    """
+    Low band of `wavelet_decomposition_np` for a (H, W, C) float32 image, computed with separable OpenCV
+    filters over all channels at once. `image` is used as one of the two working buffers and is overwritten.
+    """
+    h, w = image.shape[:2]
+    cur, tmp = image, np.empty_like(image)
+    for i in range(levels):
+        radius = 2 ** i
+        cv2.sepFilter2D(cur, -1, _WAVELET_KERNEL_1D, _WAVELET_KERNEL_1D, dst=tmp, borderType=cv2.BORDER_REPLICATE)
+        if radius > 1:
+            small = (max(int(round(h / radius)), 1), max(int(round(w / radius)), 1))
+            down = cv2.remap(tmp, *_zoom_maps((h, w), small), cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+            cv2.remap(down, *_zoom_maps(small, (h, w)), cv2.INTER_LINEAR, dst=cur, borderMode=cv2.BORDER_REPLICATE)
+        else:
+            cur, tmp = tmp, cur
+    return cur
+
+def wavelet_color_fix_cv(fused: np.ndarray, mask: np.ndarray, levels=5) -> np.ndarray:
+    """
+    Faster equivalent of `wavelet_color_fix_np`.
+
+    The high bands of `fused` sum up to `fused` minus its low band, and the low band is linear, so the
+    reconstruction is `fused + lowpass(mask - fused)` and needs a single decomposition.
+    """
+    content = np.asarray(fused, dtype=np.float32) * np.float32(1 / 255.0)
+    diff = np.asarray(mask, dtype=np.float32) * np.float32(1 / 255.0)
+    diff -= content
+
+    content += wavelet_lowpass_cv(diff, levels)
+    content *= 255.0
+    np.clip(content, 0, 255, out=content)
+    return content.astype(np.uint8)
+
 def attention_guided_fusion(ori: np.ndarray, removed: np.ndarray, attn_map: np.ndarray, multiple: int = 8):
     H, W = ori.shape[:2]
     attn_map = attn_map.astype(np.float32)
@@ -55,24 +109,103 @@ def attention_guided_fusion(ori: np.ndarray, removed: np.ndarray, attn_map: np.n
     am = am/255.0
     am_up = cv2.resize(am, (W, H), interpolation=cv2.INTER_NEAREST)
 
-    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (21,21))
-    am_d = cv2.dilate(am_up, kernel, iterations=1)
-    am_d = cv2.GaussianBlur(am_d.astype(np.float32), (9,9), sigmaX=2)
+    am_d = cv2.dilate(am_up, ellipse_kernel(21), iterations=1)
+    am_d = cv2.GaussianBlur(am_d, (9,9), sigmaX=2)
 
     am_merged = np.maximum(am_up, am_d)
     am_merged = np.clip(am_merged, 0, 1)
 
-    attn_up_3c = np.stack([am_merged]*3, axis=-1)
-    attn_up_ori_3c = np.stack([am_up]*3, axis=-1)
+    attn_up_3c = am_merged[..., None]
+    keep_3c = (1 - am_up)[..., None]
 
-    ori_out = ori * (1 - attn_up_ori_3c)
-    rem_out = removed * (1 - attn_up_ori_3c)
+    ori_out = ori * keep_3c
+    rem_out = removed * keep_3c
 
     ori_pad, h0, w0 = pad_to_multiple(ori_out, multiple)
     rem_pad, _, _   = pad_to_multiple(rem_out, multiple)
 
-    wave_rgb = wavelet_color_fix_np(ori_pad, rem_pad)
+    wave_rgb = wavelet_color_fix_cv(ori_pad, rem_pad)
     wave = crop_to_original(wave_rgb, h0, w0)
 
     fused = (wave * (1 - attn_up_3c) + removed * attn_up_3c).astype(np.uint8)
-    return fused
\ No newline at end of file
+    return fused
+
+
+def ellipse_kernel_pt(size: int, device=None, dtype=torch.float32) -> torch.Tensor:
+    # same shape as cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (size, size))
+    r = size // 2
+    dy = torch.arange(size, dtype=torch.float64) - r
+    dx = torch.round(r * torch.sqrt(torch.clamp(1 - dy ** 2 / r ** 2, min=0)))
+    cols = torch.arange(size, dtype=torch.float64)
+    kernel = (cols[None, :] - r).abs() <= dx[:, None]
+    return kernel.to(device=device, dtype=dtype)
+
+def gaussian_kernel_pt(size: int, sigma: float, device=None, dtype=torch.float32) -> torch.Tensor:
+    x = torch.arange(size, dtype=torch.float64) - (size - 1) / 2
+    kernel = torch.exp(-x ** 2 / (2 * sigma ** 2))
+    return (kernel / kernel.sum()).to(device=device, dtype=dtype)
+
+def wavelet_blur_pt(image: torch.Tensor, radius: int):
+    c = image.shape[1]
+    kernel = torch.tensor([
+        [0.0625, 0.125, 0.0625],
+        [0.125,  0.25,  0.125],
+        [0.0625, 0.125, 0.0625]
+    ], device=image.device, dtype=image.dtype).expand(c, 1, 3, 3)
+
+    blurred = F.conv2d(F.pad(image, (1, 1, 1, 1), mode='replicate'), kernel, groups=c)
+    if radius > 1:
+        # scipy.ndimage.zoom(order=1) maps corner pixels onto each other
+        h, w = blurred.shape[-2:]
+        small = (max(round(h / radius), 1), max(round(w / radius), 1))
+        blurred = F.interpolate(blurred, size=small, mode='bilinear', align_corners=True)
+        blurred = F.interpolate(blurred, size=(h, w), mode='bilinear', align_corners=True)
+    return blurred
+
+def wavelet_lowpass_pt(image: torch.Tensor, levels=5):
+    for i in range(levels):
+        image = wavelet_blur_pt(image, 2 ** i)
+    return image
+
+def wavelet_color_fix_pt(fused: torch.Tensor, mask: torch.Tensor) -> torch.Tensor:
+    # same single decomposition as `wavelet_color_fix_cv`
+    return (fused + wavelet_lowpass_pt(mask - fused)).clamp(0, 1)
+
+def attention_guided_fusion_pt(ori: torch.Tensor, removed: torch.Tensor, attn_map: torch.Tensor, multiple: int = 8, return_mask: bool = False):
+    """
+    Batched tensor version of `attention_guided_fusion`.
+
+    `ori` and `removed` are (B, 3, H, W) images in [0, 1] and `attn_map` is the (B, 1, h, w) attention map
+    in [0, 1]. The fusion runs on the device and dtype of `removed` and returns a (B, 3, H, W) image in [0, 1],
+    and with `return_mask=True` also the (B, 1, H, W) soft mask the generated image was fused in with.
+    """
+    device, dtype = removed.device, removed.dtype
+    H, W = removed.shape[-2:]
+    ori = ori.to(device=device, dtype=dtype)
+
+    # matches thresholding the uint8 map at 128
+    am = ((attn_map.float() * 255).floor() > 128).to(device=device, dtype=dtype)
+    am_up = F.interpolate(am, size=(H, W), mode='nearest')
+
+    kernel = ellipse_kernel_pt(21, device=device, dtype=dtype)[None, None]
+    am_d = (F.conv2d(am_up, kernel, padding=10) > 0).to(dtype)
+    gauss = gaussian_kernel_pt(9, 2, device=device, dtype=dtype)
+    am_d = F.conv2d(F.pad(am_d, (4, 4, 0, 0), mode='reflect'), gauss.view(1, 1, 1, 9))
+    am_d = F.conv2d(F.pad(am_d, (0, 0, 4, 4), mode='reflect'), gauss.view(1, 1, 9, 1))
+
+    am_merged = torch.maximum(am_up, am_d).clamp(0, 1)
+
+    ori_out = ori * (1 - am_up)
+    rem_out = removed * (1 - am_up)
+
+    pad_h = (multiple - H % multiple) % multiple
+    pad_w = (multiple - W % multiple) % multiple
+    ori_pad = F.pad(ori_out, (0, pad_w, 0, pad_h), mode='reflect')
+    rem_pad = F.pad(rem_out, (0, pad_w, 0, pad_h), mode='reflect')
+
+    wave = wavelet_color_fix_pt(ori_pad, rem_pad)[..., :H, :W]
+
+    fused = wave * (1 - am_merged) + removed * am_merged
+    if return_mask:
+        return fused, am_merged
+    return fused
@@ -1,5 +1,5 @@
 import numpy as np
-from PIL import Image
+from PIL import Image, ImageFilter
 
 
 def pad_to_multiple(image: np.ndarray, multiple: int = 8):
@@ -15,8 +15,10 @@ def pad_to_multiple(image: np.ndarray, multiple: int = 8):
 def crop_to_original(image: np.ndarray, h: int, w: int):
     return image[:h, :w]
 
-def resize_by_short_side(image, target_short=512, resample=Image.BICUBIC):
-    w, h = image.size
+def short_side_size(w, h, target_short=512):
+    """
+    Size `resize_by_short_side` resizes a (w, h) image to.
+    """
     if min(w, h) < target_short:
         new_w = (w + 15) // 16 * 16
         new_h = (h + 15) // 16 * 16
@@ -30,4 +32,57 @@ def resize_by_short_side(image, target_short=512, resample=Image.BICUBIC):
         new_w = (new_w + 15) // 16 * 16
         new_h = (new_h + 15) // 16 * 16
 
-    return image.resize((new_w, new_h), resample=resample)
\ No newline at end of file
+    return new_w, new_h
+
+def resize_by_short_side(image, target_short=512, resample=Image.BICUBIC):
+    return image.resize(short_side_size(*image.size, target_short), resample=resample)
+
+def mask_crop_size(mask, pad=32, target_short=512):
+    """
+    Size to denoise at when only the window around the mask is diffused (`padding_mask_crop=pad`):
+    the padded mask bbox, grown to `target_short` on each side where the image allows it.
+    """
+    w, h = mask.size
+    bbox = mask.convert("L").getbbox()
+    if bbox is None:
+        return short_side_size(w, h, target_short)
+
+    x1, y1, x2, y2 = bbox
+    crop_w = min(w, max(x2 - x1 + 2 * pad, target_short))
+    crop_h = min(h, max(y2 - y1 + 2 * pad, target_short))
+    return short_side_size(crop_w, crop_h, target_short)
+
+def paste_crop(image, crop, crop_coords, mask=None, feather=16):
+    """
+    Paste `crop` back into a copy of `image` at `crop_coords` (x1, y1, x2, y2), fading it in
+    over `feather` pixels along the box edges that lie inside the image.
+
+    With `mask`, the fuse mask of the window at any size, only the masked pixels, grown and
+    faded over `feather` pixels, are taken from `crop`; every other pixel stays identical to
+    `image` instead of going through the VAE and the resize.
+    """
+    x1, y1, x2, y2 = crop_coords
+    w, h = x2 - x1, y2 - y1
+    crop = crop.convert("RGB").resize((w, h), resample=Image.BICUBIC)
+
+    xs = np.arange(w, dtype=np.float32)[None, :]
+    ys = np.arange(h, dtype=np.float32)[:, None]
+    dist = np.full((h, w), np.inf, dtype=np.float32)
+    if x1 > 0:
+        dist = np.minimum(dist, xs + 1)
+    if y1 > 0:
+        dist = np.minimum(dist, ys + 1)
+    if x2 < image.width:
+        dist = np.minimum(dist, w - xs)
+    if y2 < image.height:
+        dist = np.minimum(dist, h - ys)
+    alpha = np.clip(dist / (feather + 1), 0, 1)
+
+    if mask is not None:
+        mask = mask.convert("L").resize((w, h), resample=Image.BILINEAR)
+        mask = mask.filter(ImageFilter.MaxFilter(2 * (feather // 2) + 1)).filter(ImageFilter.GaussianBlur(feather / 2))
+        alpha = np.minimum(alpha, np.asarray(mask, dtype=np.float32) / 255)
+
+    result = image.convert("RGB")
+    result.paste(crop, (x1, y1), Image.fromarray((alpha * 255).astype(np.uint8), mode="L"))
+    return result
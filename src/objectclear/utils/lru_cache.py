@@ -0,0 +1,59 @@
+import threading
+from collections import OrderedDict
+
+import torch
+
+from .seeding import content_digest
+
+
+class LRUCache:
+    """
+    Small thread-safe, size-bounded mapping that evicts the least recently used entry.
+    """
+
+    def __init__(self, max_size: int = 128):
+        if max_size <= 0:
+            raise ValueError(f"`max_size` has to be a positive integer but is {max_size}.")
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def items(self):
+        """
+        Snapshot of the entries, least recently used first.
+        """
+        with self._lock:
+            return list(self._data.items())
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+
+def tensor_digest(tensor: torch.Tensor) -> str:
+    """
+    Content hash of a tensor, including its shape and dtype.
+    """
+    return content_digest(tensor)
@@ -0,0 +1,75 @@
+from dataclasses import dataclass
+from typing import Optional, Union
+
+import torch
+
+
+PRECISIONS = ("auto", "fp32", "bf16", "fp16")
+
+
+@dataclass(frozen=True)
+class PrecisionPolicy:
+    """
+    Dtypes the pipeline is loaded and run with on a given device.
+
+    `torch_dtype` and `variant` are used to load the UNet and encoders, `autocast_dtype` (if set) is the
+    autocast dtype of the denoising loop and `vae_dtype` is the dtype the VAE is kept in for good.
+    """
+    device: torch.device
+    precision: str
+    torch_dtype: torch.dtype
+    variant: Optional[str]
+    autocast_dtype: Optional[torch.dtype]
+    vae_dtype: torch.dtype
+
+    def __str__(self):
+        autocast = str(self.autocast_dtype).replace("torch.", "") if self.autocast_dtype else "off"
+        return (
+            f"{self.precision} on {self.device.type}: weights {str(self.torch_dtype).replace('torch.', '')}"
+            f" (variant {self.variant}), autocast {autocast}, vae {str(self.vae_dtype).replace('torch.', '')}"
+        )
+
+
+def cpu_supports_bf16() -> bool:
+    """
+    Whether oneDNN has native bfloat16 kernels on this CPU (AVX512-BF16 / AMX).
+    """
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def select_precision(device: Union[str, torch.device], precision: str = "auto") -> PrecisionPolicy:
+    """
+    Pick the precision to run on `device` with.
+
+    `auto` resolves to fp16 on GPU, and on CPU to bf16 autocast over float32 weights where the CPU has bfloat16
+    kernels, float32 otherwise. fp16 weights are never picked automatically on CPU, where fp16 matmuls are emulated.
+    The VAE stays in float32 in every mode.
+    """
+    device = torch.device(device)
+    if precision not in PRECISIONS:
+        raise ValueError(f"`precision` has to be one of {PRECISIONS} but is {precision!r}.")
+
+    if precision == "auto":
+        if device.type == "cuda":
+            precision = "fp16"
+        else:
+            precision = "bf16" if cpu_supports_bf16() else "fp32"
+
+    if precision == "fp16":
+        torch_dtype, variant, autocast_dtype = torch.float16, "fp16", None
+    elif precision == "bf16":
+        torch_dtype, variant, autocast_dtype = torch.float32, None, torch.bfloat16
+    else:
+        torch_dtype, variant, autocast_dtype = torch.float32, None, None
+
+    return PrecisionPolicy(
+        device=device,
+        precision=precision,
+        torch_dtype=torch_dtype,
+        variant=variant,
+        autocast_dtype=autocast_dtype,
+        vae_dtype=torch.float32,
+    )
@@ -0,0 +1,83 @@
+import os
+import threading
+from typing import Optional, Tuple
+
+import torch
+
+from .lru_cache import LRUCache
+
+
+class PromptEmbeddingCache:
+    """
+    In-memory store of text-encoder outputs for single prompts, keyed by
+    (prompt, prompt_2, negative_prompt, negative_prompt_2, clip_skip, dtype).
+
+    Each entry holds the `(prompt_embeds, negative_prompt_embeds, pooled_prompt_embeds,
+    negative_pooled_prompt_embeds)` tuple for one prompt with a batch dimension of 1,
+    and the whole cache can be written to / read from disk with `save` and `load`.
+    At most `max_size` prompts are kept, the least recently used are evicted first.
+    """
+
+    def __init__(self, max_size: int = 256):
+        # prompt key -> {str(dtype): entry}, so a dtype miss finds the other dtypes of the prompt directly
+        self._entries = LRUCache(max_size)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(prompt, prompt_2=None, negative_prompt=None, negative_prompt_2=None, clip_skip=None):
+        return (prompt, prompt_2, negative_prompt, negative_prompt_2, clip_skip)
+
+    def get(self, key, dtype: torch.dtype) -> Optional[Tuple[torch.Tensor, ...]]:
+        """
+        Look up `key` in `dtype`. An entry stored in another dtype is cast and returned instead of a miss.
+        """
+        with self._lock:
+            by_dtype = self._entries.get(key)
+            if by_dtype is None:
+                return None
+            entry = by_dtype.get(str(dtype))
+            if entry is None:
+                entry = tuple(t.to(dtype) for t in next(iter(by_dtype.values())))
+                by_dtype[str(dtype)] = entry
+            return entry
+
+    def put(self, key, dtype: torch.dtype, embeds: Tuple[torch.Tensor, ...]):
+        with self._lock:
+            by_dtype = self._entries.get(key)
+            if by_dtype is None:
+                by_dtype = {}
+                self._entries.put(key, by_dtype)
+            by_dtype[str(dtype)] = tuple(t.detach() for t in embeds)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(by_dtype) for _, by_dtype in self._entries.items())
+
+    def save(self, path: str):
+        with self._lock:
+            entries = {
+                key + (dtype,): tuple(t.cpu() for t in entry)
+                for key, by_dtype in self._entries.items()
+                for dtype, entry in by_dtype.items()
+            }
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        torch.save(entries, path)
+
+    @classmethod
+    def load(cls, path: str, max_size: int = 256) -> "PromptEmbeddingCache":
+        """
+        Read a cache written by `save`. It is sized to keep every prompt of the file.
+        """
+        entries = torch.load(path, map_location="cpu")
+        cache = cls(max(max_size, len({key[:-1] for key in entries})))
+        for key, entry in entries.items():
+            by_dtype = cache._entries.get(key[:-1])
+            if by_dtype is None:
+                by_dtype = {}
+                cache._entries.put(key[:-1], by_dtype)
+            by_dtype[key[-1]] = entry
+        return cache
@@ -0,0 +1,42 @@
+import hashlib
+from typing import Union
+
+import numpy as np
+import PIL.Image
+import torch
+
+
+def content_digest(*parts: Union[bytes, str, PIL.Image.Image, np.ndarray, torch.Tensor]) -> str:
+    """
+    sha256 over the content of `parts`: raw bytes, strings, or the pixels (with size and mode/dtype) of images,
+    arrays and tensors.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, PIL.Image.Image):
+            data = f"{part.mode}{part.size}".encode() + part.tobytes()
+        elif isinstance(part, torch.Tensor):
+            part = part.detach().to("cpu").contiguous()
+            data = f"{tuple(part.shape)}{part.dtype}".encode() + part.flatten().view(torch.uint8).numpy().tobytes()
+        elif isinstance(part, np.ndarray):
+            data = f"{part.shape}{part.dtype}".encode() + np.ascontiguousarray(part).tobytes()
+        elif isinstance(part, str):
+            data = part.encode()
+        else:
+            data = bytes(part)
+        # length-prefixed so that the parts cannot run into each other
+        digest.update(len(data).to_bytes(8, "big"))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+def content_seed(seed: int, digest: str) -> int:
+    """
+    Seed for the input with content `digest` under the configured `seed`. Depends on nothing else, so the same
+    input gets the same noise on every replica, after restarts and in any batch.
+    """
+    return int.from_bytes(hashlib.sha256(f"{seed}:{digest}".encode()).digest()[:8], "big") & (2**63 - 1)
+
+
+def content_generator(seed: int, digest: str, device: Union[str, torch.device] = "cpu") -> torch.Generator:
+    return torch.Generator(device=device).manual_seed(content_seed(seed, digest))
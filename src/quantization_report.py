@@ -0,0 +1,146 @@
+import os
+import sys
+import argparse
+import glob
+import json
+import resource
+import subprocess
+import tempfile
+import time
+import numpy as np
+import torch
+from PIL import Image
+from objectclear.pipelines import ObjectClearPipeline
+from objectclear.utils import resize_by_short_side
+
+
+MODES = ["none", "int8", "int8-conv"]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def load_samples(input_path, mask_path):
+    input_img_list = sorted(glob.glob(os.path.join(input_path, '*.[jpJP][pnPN]*[gG]')))
+    input_mask_list = sorted(glob.glob(os.path.join(mask_path, '*.[jpJP][pnPN]*[gG]')))
+    if len(input_img_list) != len(input_mask_list):
+        raise ValueError(f"Mismatch between input images ({len(input_img_list)}) and masks ({len(input_mask_list)}).")
+
+    samples = []
+    for img_path, mask_path in zip(input_img_list, input_mask_list):
+        image = resize_by_short_side(Image.open(img_path).convert("RGB"), 512, resample=Image.BICUBIC)
+        mask = resize_by_short_side(Image.open(mask_path).convert("L"), 512, resample=Image.NEAREST)
+        samples.append((image, mask))
+    return samples
+
+def run_mode(args, mode, out_dir):
+    """
+    Load the pipeline with quantization `mode`, run every sample and write the outputs and metrics to `out_dir`.
+    Runs in its own process so that the RSS numbers are not mixed up between modes.
+    """
+    samples = load_samples(args.input_path, args.mask_path)
+
+    start = time.perf_counter()
+    pipe = ObjectClearPipeline.from_pretrained_with_custom_modules(
+        "jixin0101/ObjectClear",
+        torch_dtype=torch.float32,
+        cache_dir=args.cache_dir,
+        quantize=None if mode == "none" else mode,
+    )
+    load_seconds = time.perf_counter() - start
+    rss_loaded = peak_rss_mb()
+
+    outputs, seconds = [], []
+    for image, mask in samples:
+        w, h = image.size
+        start = time.perf_counter()
+        result = pipe(
+            prompt="remove the instance of object",
+            image=image,
+            mask_image=mask,
+            generator=torch.Generator(device="cpu").manual_seed(args.seed),
+            num_inference_steps=args.steps,
+            guidance_scale=args.guidance_scale,
+            height=h,
+            width=w,
+        )
+        seconds.append(time.perf_counter() - start)
+        outputs.append(np.array(result.images[0]))
+
+    np.savez(os.path.join(out_dir, f"{mode}.npz"), *outputs)
+    with open(os.path.join(out_dir, f"{mode}.json"), 'w') as f:
+        json.dump({
+            "load_seconds": load_seconds,
+            "seconds_per_image": float(np.mean(seconds)),
+            "rss_after_load_mb": rss_loaded,
+            "peak_rss_mb": peak_rss_mb(),
+        }, f)
+
+def drift(outputs, baseline):
+    diffs = [np.abs(o.astype(np.float64) - b.astype(np.float64)) for o, b in zip(outputs, baseline)]
+    mse = np.mean([(d ** 2).mean() for d in diffs])
+    return {
+        "mean_abs_diff": float(np.mean([d.mean() for d in diffs])),
+        "max_abs_diff": float(max(d.max() for d in diffs)),
+        "psnr": float('inf') if mse == 0 else float(10 * np.log10(255.0 ** 2 / mse)),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Report latency, RSS and output drift of the int8 quantization modes on CPU.')
+
+    parser.add_argument('-i', '--input_path', type=str, default='./inputs/imgs',
+                        help='Input image folder. Default: inputs/imgs')
+    parser.add_argument('-m', '--mask_path', type=str, default='./inputs/masks',
+                        help='Input mask folder. Default: inputs/masks')
+    parser.add_argument('-o', '--output_path', type=str, default='results/quantization_report.json',
+                        help='Where to write the report. Default: results/quantization_report.json')
+    parser.add_argument('--cache_dir', type=str, default=None,
+                        help="Path to cache directory")
+    parser.add_argument('--modes', type=str, nargs='+', default=MODES, choices=MODES,
+                        help='Quantization modes to compare, "none" is the float32 baseline. Default: all')
+    parser.add_argument('--seed', type=int, default=42,
+                        help='Random seed for torch.Generator. Default: 42')
+    parser.add_argument('--steps', type=int, default=20,
+                        help='Number of diffusion inference steps. Default: 20')
+    parser.add_argument('--guidance_scale', type=float, default=2.5,
+                        help='CFG guidance scale. Default: 2.5')
+    parser.add_argument('--run_mode', type=str, default=None, choices=MODES,
+                        help=argparse.SUPPRESS)
+    parser.add_argument('--run_dir', type=str, default=None,
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_mode is not None:
+        run_mode(args, args.run_mode, args.run_dir)
+        sys.exit(0)
+
+    modes = ["none"] + [mode for mode in args.modes if mode != "none"]
+    report = {}
+    with tempfile.TemporaryDirectory() as run_dir:
+        for mode in modes:
+            cmd = [sys.executable, os.path.abspath(__file__), '--run_mode', mode, '--run_dir', run_dir]
+            for name in ('input_path', 'mask_path', 'cache_dir', 'seed', 'steps', 'guidance_scale'):
+                if getattr(args, name) is not None:
+                    cmd += [f'--{name}', str(getattr(args, name))]
+            print(f'Running mode {mode} ...')
+            subprocess.run(cmd, check=True)
+
+            with open(os.path.join(run_dir, f"{mode}.json")) as f:
+                report[mode] = json.load(f)
+            outputs = np.load(os.path.join(run_dir, f"{mode}.npz"))
+            outputs = [outputs[key] for key in outputs.files]
+            if mode == "none":
+                baseline = outputs
+            else:
+                report[mode].update(drift(outputs, baseline))
+                report[mode]["speedup"] = report["none"]["seconds_per_image"] / report[mode]["seconds_per_image"]
+
+    for mode, metrics in report.items():
+        print(f'{mode:>10}: ' + ', '.join(f'{k}={v:.3f}' for k, v in metrics.items()))
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output_path)), exist_ok=True)
+    with open(args.output_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Report written to {args.output_path}')
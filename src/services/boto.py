@@ -1,4 +1,7 @@
+from typing import Optional
+
 import boto3
+from botocore.exceptions import ClientError
 from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
 
 def encode_dict_to_dynamodb_map(data: dict):
@@ -12,8 +15,8 @@ def decode_dynamodb_map_to_dict(dynamodb_map: dict):
 
 
 class JobStatusDynamo:
-    def __init__(self):
-        self.client = boto3.client("dynamodb", region_name="eu-west-1")  # type: ignore
+    def __init__(self, client=None):
+        self.client = client or boto3.client("dynamodb", region_name="eu-west-1")  # type: ignore
         self.table = "vc-job-status"
         self.region = "eu-west-1"
 
@@ -30,10 +33,20 @@ class JobStatusDynamo:
 
 
 class S3:
-    def __init__(self, bucket: str) -> None:
-        self.__s3 = boto3.client("s3")  # type: ignore
+    def __init__(self, bucket: str, client=None) -> None:
+        """
+        `client` is a boto3 S3 client to share between buckets and threads; a new one by default.
+        """
+        self.__s3 = client or boto3.client("s3")  # type: ignore
         self.__bucket = bucket
 
+    @property
+    def bucket(self) -> str:
+        return self.__bucket
+
+    def uri(self, path: str) -> str:
+        return f"s3://{self.__bucket}/{path}"
+
     def upload_file(self, src_path: str, dest_path: str):
         self.__s3.upload_file(src_path, self.__bucket, dest_path)
 
@@ -45,5 +58,18 @@ class S3:
         data = response["Body"].read()
         return data
 
+    def get_object_if_changed(self, path, etag: Optional[str] = None) -> Optional[tuple[bytes, str]]:
+        """
+        The object and its ETag, or None if its ETag still is `etag`.
+        """
+        kwargs = {"IfNoneMatch": etag} if etag else {}
+        try:
+            response = self.__s3.get_object(Bucket=self.__bucket, Key=path, **kwargs)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("304", "NotModified"):
+                return None
+            raise
+        return response["Body"].read(), response["ETag"]
+
     def delete_object(self, path):
         self.__s3.delete_object(Bucket=self.__bucket, Key=path)
\ No newline at end of file
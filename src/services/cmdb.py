@@ -1,168 +1,210 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from functools import lru_cache
 from typing import Optional
 import urllib.parse
 import requests
 import json
 from requests import Response
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
 
+# (connect, read) timeout in seconds of every CMDB request
+DEFAULT_TIMEOUT = (3.05, 30)
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    def __init__(self, *args, timeout=DEFAULT_TIMEOUT, **kwargs) -> None:
+        """
+        HTTPAdapter that applies `timeout` to every request that does not set its own.
+        """
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def create_session(timeout=DEFAULT_TIMEOUT, retries: int = 3, backoff_factor: float = 0.5, pool_maxsize: int = 10) -> requests.Session:
+    """
+    Keep-alive session with a bounded connection pool, a default timeout and retries with
+    exponential backoff. Connection errors are retried for every method; 429/5xx responses
+    only for idempotent ones, so a POST is never sent twice.
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=(429, 500, 502, 503, 504),
+        raise_on_status=False,
+    )
+    adapter = TimeoutHTTPAdapter(timeout=timeout, max_retries=retry, pool_connections=1, pool_maxsize=pool_maxsize)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
 class CMDB:
-    def __init__(self, url: str) -> None:
+    def __init__(self, url: str, session: Optional[requests.Session] = None) -> None:
         self.url = url
         self.headers = {
         'Content-Type': 'application/json'
         }
+        self.session = session or create_session()
 
     @lru_cache(maxsize=128)
     def get_sites(self) -> Response:
         url = f"{self.url}/api/sites"
-        response = requests.get(url, headers=self.headers)
+        response = self.session.get(url, headers=self.headers)
         return response
 
     def get_advertisments(self) -> Response:
         url = f"{self.url}/api/advertisements"
-        response = requests.get(url, headers=self.headers)
+        response = self.session.get(url, headers=self.headers)
         return response
 
     def update_advertisement(self, id: int, data: dict) -> Response:
         url = f"{self.url}/api/advertisements/{str(id)}"
-        response = requests.put(url, headers=self.headers, data=json.dumps(data))
+        response = self.session.put(url, headers=self.headers, data=json.dumps(data))
         return response
 
     def get_advertisment_by_username(self, username) -> Response:
         url = f"{self.url}/api/advertisements/search?username={username}"
-        response = requests.get(url, headers=self.headers)
+        response = self.session.get(url, headers=self.headers)
         return response
 
     def get_advertisment_by_section(self, section: str) -> Response:
         url = f"{self.url}/api/advertisements/search?section={section}"
-        response = requests.get(url, headers=self.headers)
+        response = self.session.get(url, headers=self.headers)
         return response
 
     def get_blacklisted_advertisments(self) -> Response:
         url = f"{self.url}/api/advertisements/search?blacklist=true"
-        response = requests.get(url, headers=self.headers)
+        response = self.session.get(url, headers=self.headers)
         return response
 
     def get_contact(self, id: int) -> Response:
         url = f"{self.url}/api/contacts/{str(id)}"
-        response = requests.get(url, headers=self.headers)
+        response = self.session.get(url, headers=self.headers)
         return response
 
     def get_contact_list(self, page_num: int, page_size: int) -> Response:
         url = f"{self.url}/api/contacts"
         params = {'pageNum': page_num, 'pageSize': page_size}
-        response = requests.get(url, headers=self.headers, params=params)
+        response = self.session.get(url, headers=self.headers, params=params)
         return response
 
     def get_advertisement_list(self) -> Response:
         url = f"{self.url}/api/advertisements"
-        response = requests.get(url, headers=self.headers)
+        response = self.session.get(url, headers=self.headers)
         return response
 
     def get_location_list(self) -> Response:
         url = f"{self.url}/api/locations"
-        response = requests.get(url, headers=self.headers)
+        response = self.session.get(url, headers=self.headers)
         return response
 
     def get_contact_by_phone(self, phone: str):
         phone = urllib.parse.quote(phone)
         url = f"{self.url}/api/contacts/search?phone={phone}"
-        response = requests.get(url, headers=self.headers)
+        response = self.session.get(url, headers=self.headers)
         return response
 
     def update_contact(self, id: int, contact: dict) -> Response:
         url = f"{self.url}/api/contacts/{str(id)}"
-        response = requests.put(url, headers=self.headers, data=json.dumps(contact))
+        response = self.session.put(url, headers=self.headers, data=json.dumps(contact))
         return response
 
     def create_contact(self, contact: dict) -> Response:
         url = f"{self.url}/api/contacts"
-        response = requests.post(url, headers=self.headers, data=json.dumps(contact))
+        response = self.session.post(url, headers=self.headers, data=json.dumps(contact))
         return response
 
     def create_content(self, content: dict) -> Response:
         url = f"{self.url}/api/content"
-        response = requests.post(url, headers=self.headers, data=json.dumps(content))
+        response = self.session.post(url, headers=self.headers, data=json.dumps(content))
         return response
 
     def get_verified_profiles(self, domain: Optional[str] = None) -> Response:
         url = f"{self.url}/api/profiles/verified"
         if domain:
             params = {'domain': domain}
-            response = requests.get(url, params=params)
+            response = self.session.get(url, params=params)
         else:
-            response = requests.get(url)
+            response = self.session.get(url)
         return response
 
     def get_content_score_greater_than(self, score: int):
         url = f"{self.url}/api/content/score?gt={str(score)}"
-        response = requests.get(url, headers=self.headers)
+        response = self.session.get(url, headers=self.headers)
         return response
 
     def get_profile_by_url(self, url: str):
         url = urllib.parse.quote(url)
         url = f"{self.url}/api/profiles/search?url={url}"
-        response = requests.get(url, headers=self.headers)
+        response = self.session.get(url, headers=self.headers)
         return response
 
     def get_profile_by_phone(self, phone: str):
         phone = urllib.parse.quote(phone)
         url = f"{self.url}/api/profiles/search?phone={phone}"
-        response = requests.get(url, headers=self.headers)
+        response = self.session.get(url, headers=self.headers)
         return response
 
     def get_profiles_score_greater_than(self, score: float):
         url = f"{self.url}/api/profiles/score?gt={str(score)}"
-        response = requests.get(url, headers=self.headers)
+        response = self.session.get(url, headers=self.headers)
         return response
 
     def get_profiles_list(self, page_num: int, page_size: int) -> Response:
         url = f"{self.url}/api/profiles"
         params = {'pageNum': page_num, 'pageSize': page_size}
-        response = requests.get(url, headers=self.headers, params=params)
+        response = self.session.get(url, headers=self.headers, params=params)
         return response
 
     def update_profile(self, id: int, profile: dict):
         url = f"{self.url}/api/profiles/{str(id)}"
-        response = requests.put(url, headers=self.headers, data=json.dumps(profile))
+        response = self.session.put(url, headers=self.headers, data=json.dumps(profile))
         return response
 
     def set_profiles_inactive(self) -> Response:
         url = f"{self.url}/api/profiles/inactive"
-        response = requests.put(url, headers=self.headers)
+        response = self.session.put(url, headers=self.headers)
         return response
 
     def create_profile(self, profile: dict) -> Response:
         url = f"{self.url}/api/profiles"
-        response = requests.post(url, headers=self.headers, data=json.dumps(profile))
+        response = self.session.post(url, headers=self.headers, data=json.dumps(profile))
         return response
 
     def update_profile_info(self, id: int, profile_info: dict):
         url = f"{self.url}/api/profile-info/{str(id)}"
-        response = requests.put(url, headers=self.headers, data=json.dumps(profile_info))
+        response = self.session.put(url, headers=self.headers, data=json.dumps(profile_info))
         return response
 
     def create_profile_info(self, profile_info: dict) -> Response:
         url = f"{self.url}/api/profile-info"
-        response = requests.post(url, headers=self.headers, data=json.dumps(profile_info))
+        response = self.session.post(url, headers=self.headers, data=json.dumps(profile_info))
         return response
 
     def get_content_by_id(self, id: str):
         url = f"{self.url}/api/content/{id}"
-        response = requests.get(url, headers=self.headers)
+        response = self.session.get(url, headers=self.headers)
         return response
 
     def get_content_by_phone(self, phone: str):
         phone = urllib.parse.quote(phone)
         url = f"{self.url}/api/content/search?phone={phone}"
-        response = requests.get(url, headers=self.headers)
+        response = self.session.get(url, headers=self.headers)
         return response
 
     def get_s3_content_by_url(self, url: str):
         url = urllib.parse.quote(url)
         url = f"{self.url}/api/s3/search?url={url}"
-        response = requests.get(url, headers=self.headers)
+        response = self.session.get(url, headers=self.headers)
         return response
 
     def create_s3_content(self, s3_content: dict) -> Response:
@@ -174,5 +216,38 @@ class CMDB:
         }
         """
         url = f"{self.url}/api/s3"
-        response = requests.post(url, headers=self.headers, data=json.dumps(s3_content))
-        return response
\ No newline at end of file
+        response = self.session.post(url, headers=self.headers, data=json.dumps(s3_content))
+        return response
+
+    def create_s3_contents(self, s3_contents: list[dict], max_workers: int = 4) -> list[Response]:
+        """
+        Create several s3 records concurrently over the pooled connections, in the order given.
+        """
+        if len(s3_contents) <= 1:
+            return [self.create_s3_content(s3_content) for s3_content in s3_contents]
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(s3_contents))) as executor:
+            return list(executor.map(self.create_s3_content, s3_contents))
+
+    def close(self) -> None:
+        self.session.close()
+
+
+class AsyncCMDB:
+    def __init__(self, cmdb: CMDB) -> None:
+        """
+        asyncio front for a `CMDB`: every call runs on the default executor over the same pooled
+        session, so coroutines can issue CMDB requests concurrently without blocking the loop.
+        """
+        self.cmdb = cmdb
+
+    def __getattr__(self, name):
+        method = getattr(self.cmdb, name)
+        if not callable(method):
+            return method
+
+        async def call(*args, **kwargs):
+            return await asyncio.to_thread(method, *args, **kwargs)
+        return call
+
+    async def create_s3_contents(self, s3_contents: list[dict]) -> list[Response]:
+        return list(await asyncio.gather(*(self.create_s3_content(s3_content) for s3_content in s3_contents)))
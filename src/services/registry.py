@@ -0,0 +1,92 @@
+import json
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+import boto3
+from botocore.config import Config
+from services.boto import S3, JobStatusDynamo
+from services.cmdb import CMDB, create_session
+from services.logger import log
+
+
+@dataclass(frozen=True)
+class ProjectConfig:
+    """
+    Where a project keeps its files and which CMDB it records them in. The CMDB URL is read
+    from the environment variable `cmdb_url_env` unless `cmdb_url` is given.
+    """
+    bucket: str
+    cmdb_url_env: str
+    cmdb_url: Optional[str] = None
+
+    def resolve_cmdb_url(self) -> Optional[str]:
+        return self.cmdb_url or os.getenv(self.cmdb_url_env)
+
+
+DEFAULT_PROJECTS = {
+    "MINAS": ProjectConfig(bucket="minas-workspace-prod", cmdb_url_env="MINAS_CMDB_URL"),
+    "ROSA": ProjectConfig(bucket="rosa-workspace-prod", cmdb_url_env="ROSA_CMDB_URL"),
+}
+
+
+def load_projects(path: Optional[str] = None) -> dict[str, ProjectConfig]:
+    """
+    Project configuration from a JSON file mapping project ids to `ProjectConfig` fields, e.g.
+    {"MINAS": {"bucket": "minas-workspace-prod", "cmdb_url_env": "MINAS_CMDB_URL"}}.
+    The built-in MINAS/ROSA mapping without a file.
+    """
+    if path is None:
+        return dict(DEFAULT_PROJECTS)
+    with open(path) as f:
+        return {project_id: ProjectConfig(**config) for project_id, config in json.load(f).items()}
+
+
+@dataclass
+class ProjectClients:
+    s3: S3
+    cmdb: CMDB
+
+
+class ClientRegistry:
+    def __init__(self, projects: dict[str, ProjectConfig], pool_size: int = 10, region_name: str = "eu-west-1") -> None:
+        """
+        One S3 client, one Dynamo client and one CMDB client per project for the whole process,
+        created at startup and shared by every job and thread, so that jobs neither pay for
+        client construction nor lose the connection pools. boto3 clients and the CMDB session
+        are thread-safe; `pool_size` bounds the connections each of them keeps open.
+
+        A project whose CMDB URL is not set is skipped with a warning, and its jobs fail.
+        """
+        self.pool_size = pool_size
+        config = Config(max_pool_connections=pool_size)
+        self._s3_client = boto3.client("s3", config=config)  # type: ignore
+        self.dynamo = JobStatusDynamo(boto3.client("dynamodb", region_name=region_name, config=config))  # type: ignore
+        self._buckets: dict[str, S3] = {}
+        self._projects: dict[str, ProjectClients] = {}
+        for project_id, project in projects.items():
+            url = project.resolve_cmdb_url()
+            if url is None:
+                log.warning(f"{project.cmdb_url_env} environment variable not set, {project_id} jobs will fail")
+                continue
+            self._projects[project_id] = ProjectClients(
+                s3=self.s3(project.bucket),
+                cmdb=CMDB(url, session=create_session(pool_maxsize=pool_size)),
+            )
+
+    def s3(self, bucket: str) -> S3:
+        """
+        `S3` of `bucket` on the shared client.
+        """
+        if bucket not in self._buckets:
+            self._buckets[bucket] = S3(bucket, client=self._s3_client)
+        return self._buckets[bucket]
+
+    def project(self, project_id: str) -> ProjectClients:
+        if project_id not in self._projects:
+            raise ValueError(f"Unknown or unconfigured project_id: {project_id}")
+        return self._projects[project_id]
+
+    def close(self) -> None:
+        for clients in self._projects.values():
+            clients.cmdb.close()
@@ -0,0 +1,278 @@
+import itertools
+import threading
+import time
+import uuid
+from typing import Callable, Optional
+
+from services.logger import log
+
+# SQS takes at most 10 messages per receive and 10 entries per batch call
+MAX_BATCH = 10
+
+
+class QueueMessage:
+    def __init__(self, consumer: "SQSConsumer", message_id: str, receipt_handle: str, body: str) -> None:
+        """
+        A received message. `delete` acknowledges it; the actual deletion is batched by the consumer.
+        `release` hands it back to the queue for redelivery.
+        """
+        self._consumer = consumer
+        self.message_id = message_id
+        self.receipt_handle = receipt_handle
+        self.body = body
+
+    def delete(self) -> None:
+        self._consumer.ack(self)
+
+    def release(self) -> None:
+        self._consumer.release(self)
+
+    def __repr__(self) -> str:
+        return f"QueueMessage({self.message_id})"
+
+
+class SQSConsumer:
+    def __init__(
+        self,
+        client,
+        queue_url: str,
+        capacity: int,
+        visibility_timeout: int = 300,
+        heartbeat_interval: Optional[float] = None,
+        wait_time: int = 20,
+        ack_flush_interval: float = 1.0,
+    ) -> None:
+        """
+        Queue consumer that never holds more than `capacity` unacknowledged messages.
+
+        Messages are received with `visibility_timeout` seconds of visibility, which a background
+        heartbeat extends every `heartbeat_interval` seconds (a third of the timeout by default)
+        for as long as they are in flight, so long jobs are not redelivered to other workers.
+        Acknowledged messages are removed with `delete_message_batch`, once 10 are pending or
+        after at most `ack_flush_interval` seconds.
+
+        `client` is a boto3 SQS client or an `InMemorySQS`.
+        """
+        if capacity < 1:
+            raise ValueError(f"capacity has to be at least 1 but is {capacity}")
+        self.client = client
+        self.queue_url = queue_url
+        self.capacity = capacity
+        self.visibility_timeout = visibility_timeout
+        self.heartbeat_interval = heartbeat_interval or visibility_timeout / 3
+        self.wait_time = wait_time
+        self.ack_flush_interval = ack_flush_interval
+
+        self._lock = threading.Condition()
+        self._in_flight: dict[str, QueueMessage] = {}
+        self._acked: list[QueueMessage] = []
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "SQSConsumer":
+        self._thread = threading.Thread(target=self._background, name="sqs-heartbeat", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """
+        Stop the heartbeat and delete every acknowledged message.
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._flush_acks()
+
+    def receive(self) -> list[QueueMessage]:
+        """
+        Long-poll for as many messages as there is free capacity. Waits for an acknowledgement
+        first when the consumer is full.
+        """
+        with self._lock:
+            if not self._lock.wait_for(lambda: len(self._in_flight) < self.capacity, timeout=self.wait_time):
+                return []
+            count = min(MAX_BATCH, self.capacity - len(self._in_flight))
+
+        response = self.client.receive_message(
+            QueueUrl=self.queue_url,
+            MaxNumberOfMessages=count,
+            WaitTimeSeconds=self.wait_time,
+            VisibilityTimeout=self.visibility_timeout,
+        )
+        messages = [
+            QueueMessage(self, m["MessageId"], m["ReceiptHandle"], m["Body"]) for m in response.get("Messages", [])
+        ]
+        with self._lock:
+            for message in messages:
+                self._in_flight[message.receipt_handle] = message
+        return messages
+
+    def ack(self, message: QueueMessage) -> None:
+        with self._lock:
+            if self._in_flight.pop(message.receipt_handle, None) is None:
+                return
+            self._acked.append(message)
+            self._lock.notify_all()
+            flush = len(self._acked) >= MAX_BATCH
+        if flush:
+            self._flush_acks()
+
+    def release(self, message: QueueMessage) -> None:
+        """
+        Stop extending the visibility of a message that will not be acknowledged and make it
+        visible again right away, so that it is redelivered (or dead-lettered by the queue's
+        redrive policy) and its slot is free for the next message.
+        """
+        with self._lock:
+            if self._in_flight.pop(message.receipt_handle, None) is None:
+                return
+            self._lock.notify_all()
+        try:
+            self.client.change_message_visibility(
+                QueueUrl=self.queue_url, ReceiptHandle=message.receipt_handle, VisibilityTimeout=0
+            )
+        except Exception as e:
+            # it becomes visible again once its current visibility timeout runs out
+            log.warning(f"Could not release {message}: {e}")
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._in_flight)
+
+    def _background(self) -> None:
+        next_heartbeat = time.monotonic() + self.heartbeat_interval
+        while not self._stopped.wait(min(self.ack_flush_interval, max(0.0, next_heartbeat - time.monotonic()))):
+            self._flush_acks()
+            if time.monotonic() >= next_heartbeat:
+                self._heartbeat()
+                next_heartbeat = time.monotonic() + self.heartbeat_interval
+
+    def _heartbeat(self) -> None:
+        with self._lock:
+            messages = list(self._in_flight.values())
+        for chunk in _chunks(messages):
+            try:
+                response = self.client.change_message_visibility_batch(
+                    QueueUrl=self.queue_url,
+                    Entries=[
+                        {"Id": str(i), "ReceiptHandle": m.receipt_handle, "VisibilityTimeout": self.visibility_timeout}
+                        for i, m in enumerate(chunk)
+                    ],
+                )
+                for failure in response.get("Failed", []):
+                    log.warning(f"Could not extend visibility of {chunk[int(failure['Id'])]}: {failure.get('Message')}")
+            except Exception as e:
+                log.exception(e)
+
+    def _flush_acks(self) -> None:
+        with self._lock:
+            messages, self._acked = self._acked, []
+        for chunk in _chunks(messages):
+            try:
+                response = self.client.delete_message_batch(
+                    QueueUrl=self.queue_url,
+                    Entries=[{"Id": str(i), "ReceiptHandle": m.receipt_handle} for i, m in enumerate(chunk)],
+                )
+                for failure in response.get("Failed", []):
+                    log.warning(f"Could not delete {chunk[int(failure['Id'])]}: {failure.get('Message')}")
+            except Exception as e:
+                log.exception(e)
+
+
+def _chunks(items: list, size: int = MAX_BATCH) -> list[list]:
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+class InMemorySQS:
+    def __init__(self, clock: Callable[[], float] = time.monotonic) -> None:
+        """
+        In-process stand-in for the subset of the boto3 SQS client the consumer uses, with
+        visibility timeouts and redelivery, for tests and local runs.
+        """
+        self._clock = clock
+        self._lock = threading.Condition()
+        self._queues: dict[str, dict[str, dict]] = {}
+        self._handles = itertools.count()
+
+    def create_queue(self, QueueName: str) -> dict:
+        with self._lock:
+            self._queues.setdefault(QueueName, {})
+        return {"QueueUrl": QueueName}
+
+    def get_queue_url(self, QueueName: str) -> dict:
+        return {"QueueUrl": QueueName}
+
+    def send_message(self, QueueUrl: str, MessageBody: str) -> dict:
+        message_id = str(uuid.uuid4())
+        with self._lock:
+            self._queues[QueueUrl][message_id] = {
+                "body": MessageBody, "visible_at": 0.0, "receipt_handle": None, "receive_count": 0,
+            }
+            self._lock.notify_all()
+        return {"MessageId": message_id}
+
+    def receive_message(self, QueueUrl: str, MaxNumberOfMessages: int = 1, WaitTimeSeconds: int = 0, VisibilityTimeout: int = 30) -> dict:
+        deadline = time.monotonic() + WaitTimeSeconds
+        with self._lock:
+            while True:
+                now = self._clock()
+                visible = [(mid, m) for mid, m in self._queues[QueueUrl].items() if m["visible_at"] <= now]
+                if visible or time.monotonic() >= deadline:
+                    break
+                self._lock.wait(min(0.05, max(0.0, deadline - time.monotonic())))
+
+            messages = []
+            for message_id, message in visible[:MaxNumberOfMessages]:
+                message["visible_at"] = now + VisibilityTimeout
+                message["receipt_handle"] = f"{message_id}:{next(self._handles)}"
+                message["receive_count"] += 1
+                messages.append({"MessageId": message_id, "ReceiptHandle": message["receipt_handle"], "Body": message["body"]})
+        return {"Messages": messages} if messages else {}
+
+    def _find(self, QueueUrl: str, receipt_handle: str) -> Optional[dict]:
+        message = self._queues[QueueUrl].get(receipt_handle.split(":")[0])
+        # like SQS, only the latest receipt handle of a message is valid
+        if message is None or message["receipt_handle"] != receipt_handle:
+            return None
+        return message
+
+    def change_message_visibility(self, QueueUrl: str, ReceiptHandle: str, VisibilityTimeout: int) -> dict:
+        with self._lock:
+            message = self._find(QueueUrl, ReceiptHandle)
+            if message is None:
+                raise ValueError("invalid receipt handle")
+            message["visible_at"] = self._clock() + VisibilityTimeout
+            self._lock.notify_all()
+        return {}
+
+    def change_message_visibility_batch(self, QueueUrl: str, Entries: list[dict]) -> dict:
+        successful, failed = [], []
+        with self._lock:
+            for entry in Entries:
+                message = self._find(QueueUrl, entry["ReceiptHandle"])
+                if message is None:
+                    failed.append({"Id": entry["Id"], "Code": "ReceiptHandleIsInvalid", "SenderFault": True, "Message": "invalid receipt handle"})
+                    continue
+                message["visible_at"] = self._clock() + entry["VisibilityTimeout"]
+                successful.append({"Id": entry["Id"]})
+        return {"Successful": successful, "Failed": failed}
+
+    def delete_message_batch(self, QueueUrl: str, Entries: list[dict]) -> dict:
+        successful, failed = [], []
+        with self._lock:
+            for entry in Entries:
+                message = self._find(QueueUrl, entry["ReceiptHandle"])
+                if message is None:
+                    failed.append({"Id": entry["Id"], "Code": "ReceiptHandleIsInvalid", "SenderFault": True, "Message": "invalid receipt handle"})
+                    continue
+                del self._queues[QueueUrl][entry["ReceiptHandle"].split(":")[0]]
+                successful.append({"Id": entry["Id"]})
+        return {"Successful": successful, "Failed": failed}
+
+    def receive_count(self, QueueUrl: str, message_id: str) -> int:
+        with self._lock:
+            return self._queues[QueueUrl][message_id]["receive_count"]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(messages) for messages in self._queues.values())